@@ -7,48 +7,58 @@ import inspect
 import json
 import os
 
-import azure.cognitiveservices.speech as speech_sdk
-from dotenv import load_dotenv
-from openai import AzureOpenAI
-
+from util.clients import get_model_name, get_openai_client
+from util.history import get_history_manager
 from util.news import (
     MOST_ENGAGED_NEWS_BY_CATEGORY,
     NEWS_ARTICLE_ABSTRACT_BY_ID,
     NEWS_ARTICLE_ABSTRACT_BY_TITLE,
+    NEWS_ARTICLE_ABSTRACTS_BY_IDS,
+    TRENDING_NEWS_BY_CATEGORY,
     get_article_abstract_by_id,
     get_article_abstract_by_title,
+    get_article_abstracts_by_ids,
     get_most_engaged_news_by_category,
+    get_trending_news_by_category,
 )
-from util.openai import run_multiturn_conversation
+from util.openai import stream_multiturn_conversation
 from util.responsible_ai import get_content_filtering_message
-from util.speech import speech_to_text, text_to_speech
+from util.router import get_intent_router
+from util.speech import SentenceSpeaker, get_speech_session, split_sentences
 
 if __name__ == "__main__":
 
-    load_dotenv()
-
-    speech_ai_key = os.getenv('SPEECH_KEY')
-    speech_ai_region = os.getenv('SPEECH_REGION')
-    speech_config = speech_sdk.SpeechConfig(speech_ai_key, speech_ai_region)
-
-    client = AzureOpenAI(
-        azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_key = os.getenv("AZURE_OPENAI_KEY"),
-        api_version = os.getenv("OPENAI_API_VERSION"),
-    )
-
-    model_name = os.getenv("MODEL_NAME")
+    # the synthesizers and the recognizer are created once and kept
+    # connected between turns
+    speech = get_speech_session()
+    # with SPEECH_CONTINUOUS=1 the microphone is kept listening, instead of
+    # starting a new recognition every turn
+    continuous = os.getenv("SPEECH_CONTINUOUS", "0") == "1"
+    if continuous:
+        speech.start_continuous()
+    else:
+        speech.recognizer()
+    for voice_lang in ("en-US", "es-MX"):
+        speech.open_synthesizers(voice_lang)
+    client = get_openai_client()
+    model_name = get_model_name()
+    history = get_history_manager()
+    router = get_intent_router()
 
     tools = [
         MOST_ENGAGED_NEWS_BY_CATEGORY,
+        TRENDING_NEWS_BY_CATEGORY,
         NEWS_ARTICLE_ABSTRACT_BY_TITLE,
-        NEWS_ARTICLE_ABSTRACT_BY_ID
+        NEWS_ARTICLE_ABSTRACT_BY_ID,
+        NEWS_ARTICLE_ABSTRACTS_BY_IDS
     ]
 
     available_functions = {
         "get_most_engaged_news_by_category": get_most_engaged_news_by_category,
+        "get_trending_news_by_category": get_trending_news_by_category,
         "get_article_abstract_by_title": get_article_abstract_by_title,
-        "get_article_abstract_by_id": get_article_abstract_by_id
+        "get_article_abstract_by_id": get_article_abstract_by_id,
+        "get_article_abstracts_by_ids": get_article_abstracts_by_ids
     }
 
     next_messages = [
@@ -64,26 +74,36 @@ ding."
 
     while True:
 
-        prompt, lang = speech_to_text(speech_config)
+        if continuous:
+            prompt, lang = speech.listen()
+        else:
+            prompt, lang = speech.recognize_once()
         next_messages.append(
             {
                 "role": "user",
                 "content": prompt,
             }
         )
+        # keeps the request within the token budget however long the
+        # conversation goes on
+        history.compact(next_messages)
+        # common requests call their news function directly, saving a
+        # request to OpenAI
+        if router.inject(next_messages, lang, available_functions):
+            print("Intent router:", router.summary())
 
-        assistant_response = run_multiturn_conversation(
-            client, model_name, next_messages, tools, available_functions
-        )
-        if hasattr(assistant_response, "choices"):
-            print("OpenAI:", assistant_response.choices[0].message.content)
-            text_to_speech(
-                speech_config, assistant_response.choices[0].message.content,
-                lang)
-        elif assistant_response == "content_filter":
+        # each sentence is spoken as soon as it is generated
+        speaker = SentenceSpeaker(speech, lang)
+        try:
+            print("OpenAI:", end=" ", flush=True)
+            for sentence in split_sentences(stream_multiturn_conversation(
+                    client, model_name, next_messages, tools,
+                    available_functions)):
+                print(sentence, end=" ", flush=True)
+                speaker.speak(sentence)
+            print()
+        except Exception:
+            print()
             content_filtered_msg = get_content_filtering_message(lang)
-            text_to_speech(
-                speech_config, content_filtered_msg,
-                lang)
-        else:
-            print(assistant_response)
+            speaker.speak(content_filtered_msg)
+        speaker.close()
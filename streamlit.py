@@ -1,59 +1,109 @@
 """ This is the Streamlit version of the app. """
 
-import os
-
-import azure.cognitiveservices.speech as speech_sdk
 from audiorecorder import audiorecorder
-from azure.ai.textanalytics import TextAnalyticsClient
-from azure.core.credentials import AzureKeyCredential
-from dotenv import load_dotenv
-from openai import AzureOpenAI
 
 import streamlit as st
 from streamlit.components.v1 import html
+from util.clients import (
+    get_model_name,
+    get_openai_client,
+    get_speech_config,
+    get_text_analytics_client,
+)
+from util.history import get_history_manager
 from util.language import detect_language
 from util.news import (
     MOST_ENGAGED_NEWS_BY_CATEGORY,
     NEWS_ARTICLE_ABSTRACT_BY_ID,
     NEWS_ARTICLE_ABSTRACT_BY_TITLE,
+    NEWS_ARTICLE_ABSTRACTS_BY_IDS,
+    TRENDING_NEWS_BY_CATEGORY,
     get_article_abstract_by_id,
     get_article_abstract_by_title,
+    get_article_abstracts_by_ids,
     get_most_engaged_news_by_category,
+    get_trending_news_by_category,
 )
 from util.openai import run_multiturn_conversation
 from util.responsible_ai import get_content_filtering_message
-from util.speech import speech_to_text_streamlit, text_to_speech_streamlit
+from util.router import get_intent_router
+from util.speech import (
+    RECORDING_SAMPLE_RATE,
+    RECORDING_SAMPLE_WIDTH,
+    SYNTHESIZERS_PER_VOICE,
+    SpeechSession,
+    speech_to_text_streamlit,
+)
+from util.store import NewsStore, get_news_store
 
-load_dotenv()
 
-speech_ai_key = os.getenv('SPEECH_KEY')
-speech_ai_region = os.getenv('SPEECH_REGION')
-speech_config = speech_sdk.SpeechConfig(speech_ai_key, speech_ai_region)
+# Streamlit runs this script again on every interaction, so everything that
+# isn't specific to a user is built once per server process and shared by
+# all the sessions. Each user's conversation lives in st.session_state.
+@st.cache_resource
+def load_clients() -> tuple:
+    """ Builds the Azure AI and Azure OpenAI clients.
 
-ai_endpoint = os.getenv('LANGUAGE_ENDPOINT')
-ai_key = os.getenv('LANGUAGE_KEY')
-credential = AzureKeyCredential(ai_key)
-text_analytics_client = TextAnalyticsClient(endpoint=ai_endpoint,
-                                            credential=credential)
+    Returns:
+        tuple: the speech configuration, the text analytics client, the
+            OpenAI client and the model name.
+    """
+
+    return (get_speech_config(), get_text_analytics_client(),
+            get_openai_client(), get_model_name())
+
+
+@st.cache_resource
+def load_speech_session() -> SpeechSession:
+    """ Creates the speech session whose synthesizers return the audio for
+    the browser to play, with a pool of connected synthesizers per voice
+    shared by all the users.
+
+    Returns:
+        SpeechSession: the speech session.
+    """
+
+    speech = SpeechSession(get_speech_config(), speaker=False,
+                           pool_size=SYNTHESIZERS_PER_VOICE)
+    for voice_lang in ("en-US", "es-MX"):
+        speech.open_synthesizers(voice_lang, SYNTHESIZERS_PER_VOICE)
+    return speech
 
-client = AzureOpenAI(
-    azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_key = os.getenv("AZURE_OPENAI_KEY"),
-    api_version = os.getenv("OPENAI_API_VERSION"),
-)
 
-model_name = os.getenv("MODEL_NAME")
+@st.cache_resource
+def load_news_store() -> NewsStore:
+    """ Loads the news dataset and builds its indexes, so the first request
+    doesn't wait for them.
+
+    Returns:
+        NewsStore: the news store.
+    """
+
+    store = get_news_store()
+    store.warm_up()
+    return store
+
+
+speech_config, text_analytics_client, client, model_name = load_clients()
+speech = load_speech_session()
+load_news_store()
+history = get_history_manager()
+router = get_intent_router()
 
 tools = [
     MOST_ENGAGED_NEWS_BY_CATEGORY,
+    TRENDING_NEWS_BY_CATEGORY,
     NEWS_ARTICLE_ABSTRACT_BY_TITLE,
-    NEWS_ARTICLE_ABSTRACT_BY_ID
+    NEWS_ARTICLE_ABSTRACT_BY_ID,
+    NEWS_ARTICLE_ABSTRACTS_BY_IDS
 ]
 
 available_functions = {
     "get_most_engaged_news_by_category": get_most_engaged_news_by_category,
+    "get_trending_news_by_category": get_trending_news_by_category,
     "get_article_abstract_by_title": get_article_abstract_by_title,
-    "get_article_abstract_by_id": get_article_abstract_by_id
+    "get_article_abstract_by_id": get_article_abstract_by_id,
+    "get_article_abstracts_by_ids": get_article_abstracts_by_ids
 }
 
 
@@ -71,6 +121,11 @@ ding."
     }
 ]
 
+# the chat shown keeps only the user and assistant text, the request keeps
+# the tool calls and their results too so follow-up questions can use them
+if "request_messages" not in st.session_state:
+    st.session_state.request_messages = list(st.session_state.messages)
+
 chat_roles = ["user", "assistant"]
 
 for message in st.session_state.messages:
@@ -83,87 +138,103 @@ with st.sidebar:
     st.title("Instructions")
     st.header("Press the up arrow to start/stop recording.")
     audio = audiorecorder("Record", "Stop")
+    # filled in at the end, once this run's request has been routed
+    router_stats = st.empty()
 
 
 user_input = st.chat_input("What can I help you with?")
 
 if user_input:
     st.session_state.messages.append({"role": "user", "content": user_input})
+    st.session_state.request_messages.append(
+        {"role": "user", "content": user_input})
     lang = detect_language(text_analytics_client, [user_input])
     lang = "es-MX" if lang == "Spanish" else "en-US"
     with st.chat_message("user"):
         st.markdown(user_input)
 
     with st.chat_message("assistant"):
+        # keeps the request within the token budget however long the
+        # conversation goes on
+        request_messages = history.compact(
+            st.session_state.request_messages)
+        router.inject(request_messages, lang, available_functions)
         assistant_response = run_multiturn_conversation(
-            client, model_name,
-            st.session_state.messages, tools, available_functions
+            client, model_name, request_messages, tools, available_functions
         )
         if hasattr(assistant_response, "choices"):
-            text_to_speech_streamlit(
-                speech_config, assistant_response.choices[0].message.content,
-                lang)
+            response_audio = speech.synthesize(
+                assistant_response.choices[0].message.content, lang)
             st.write(assistant_response.choices[0].message.content)
-            st.audio("sounds/response.wav", autoplay=True)
+            st.audio(response_audio, format="audio/wav", autoplay=True)
         elif assistant_response == "content_filter":
             content_filtered_msg = get_content_filtering_message(lang)
-            text_to_speech_streamlit(
-                speech_config, content_filtered_msg,
-                lang)
+            response_audio = speech.synthesize(content_filtered_msg, lang)
             st.write(content_filtered_msg)
-            st.audio("sounds/response.wav", autoplay=True)
+            st.audio(response_audio, format="audio/wav", autoplay=True)
         else:
             print(assistant_response)
     if assistant_response != "content_filter":
-        st.session_state.messages.append(
-            {"role": "assistant",
-                "content": assistant_response.choices[0].message.content})
+        assistant_message = {
+            "role": "assistant",
+            "content": assistant_response.choices[0].message.content}
     else:
-        st.session_state.messages.append(
-            {"role": "assistant",
-                "content": content_filtered_msg})
+        assistant_message = {"role": "assistant",
+                             "content": content_filtered_msg}
+    st.session_state.messages.append(assistant_message)
+    st.session_state.request_messages.append(dict(assistant_message))
     audio = None
 
 
 if audio is not None and len(audio) > 0:
-    audio.export("sounds/prompt.wav", format="wav")
-    prompt, lang = speech_to_text_streamlit(speech_config)
+    # the recording is converted to the format the recognizer expects and
+    # pushed to it from memory
+    audio = audio.set_frame_rate(RECORDING_SAMPLE_RATE).set_channels(
+        1).set_sample_width(RECORDING_SAMPLE_WIDTH)
+    prompt, lang = speech_to_text_streamlit(speech_config, audio.raw_data)
     st.session_state.messages.append({"role": "user", "content": prompt})
+    st.session_state.request_messages.append(
+        {"role": "user", "content": prompt})
     with st.chat_message("user"):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
+        # keeps the request within the token budget however long the
+        # conversation goes on
+        request_messages = history.compact(
+            st.session_state.request_messages)
+        router.inject(request_messages, lang, available_functions)
         assistant_response = run_multiturn_conversation(
-            client, model_name,
-            st.session_state.messages, tools, available_functions
+            client, model_name, request_messages, tools, available_functions
         )
         if hasattr(assistant_response, "choices"):
-            text_to_speech_streamlit(
-                    speech_config,
-                    assistant_response.choices[0].message.content,
-                    lang)
+            response_audio = speech.synthesize(
+                assistant_response.choices[0].message.content, lang)
             st.write(assistant_response.choices[0].message.content)
-            st.audio("sounds/response.wav", autoplay=True)
+            st.audio(response_audio, format="audio/wav", autoplay=True)
         elif assistant_response == "content_filter":
             content_filtered_msg = get_content_filtering_message(lang)
-            text_to_speech_streamlit(
-                speech_config, content_filtered_msg,
-                lang)
+            response_audio = speech.synthesize(content_filtered_msg, lang)
             st.write(content_filtered_msg)
-            st.audio("sounds/response.wav", autoplay=True)
+            st.audio(response_audio, format="audio/wav", autoplay=True)
         else:
             print(assistant_response)
     if assistant_response != "content_filter":
-        st.session_state.messages.append(
-            {"role": "assistant",
-                "content": assistant_response.choices[0].message.content})
+        assistant_message = {
+            "role": "assistant",
+            "content": assistant_response.choices[0].message.content}
     else:
-        st.session_state.messages.append(
-            {"role": "assistant",
-                "content": content_filtered_msg})
+        assistant_message = {"role": "assistant",
+                             "content": content_filtered_msg}
+    st.session_state.messages.append(assistant_message)
+    st.session_state.request_messages.append(dict(assistant_message))
     audio = None
 
 
+# the router is shared by all the sessions, so this is the server's hit rate
+router_stats.caption("Intent router: " + router.summary())
+
+
 # This code allows the user to use the up arrow to stop/start recording
 code = """
     recording = false
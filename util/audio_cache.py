@@ -0,0 +1,191 @@
+""" This module caches synthesized speech in memory and on disk, so sentences
+spoken before, like the content filtering message, play back right away
+without calling Azure AI Speech again.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+
+class AudioCache:
+    """ A two-tier cache of synthesized audio keyed by the hash of the text,
+    the voice and the output format.
+
+    Lookups go to an in-memory LRU first, then to a directory with one file
+    per entry. Both tiers are capped in bytes and evict the least recently
+    used entries first. All methods are thread-safe.
+    """
+
+    def __init__(self, directory: str, memory_bytes: int = 16 * 2 ** 20,
+                 disk_bytes: int = 256 * 2 ** 20):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = None
+        self._disk_size = 0
+
+    @staticmethod
+    def key(text: str, voice: str, audio_format: str) -> str:
+        """ Builds the cache key of a synthesized text.
+
+        Args:
+            text (str): the text spoken.
+            voice (str): the name of the voice.
+            audio_format (str): the output format of the audio.
+
+        Returns:
+            str: the cache key.
+        """
+
+        return hashlib.sha256("\0".join(
+            (voice, audio_format, text)).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".audio")
+
+    def _scan(self) -> OrderedDict:
+        # the files on disk, from the least to the most recently used
+        if self._disk is None:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".audio"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name[:-6],
+                                    stat.st_size))
+            self._disk = OrderedDict(
+                (key, size) for _, key, size in sorted(entries))
+            self._disk_size = sum(self._disk.values())
+        return self._disk
+
+    def get(self, text: str, voice: str, audio_format: str) -> bytes | None:
+        """ Looks up the audio of a text.
+
+        Args:
+            text (str): the text spoken.
+            voice (str): the name of the voice.
+            audio_format (str): the output format of the audio.
+
+        Returns:
+            bytes | None: the cached audio, or None on a miss.
+        """
+
+        key = self.key(text, voice, audio_format)
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return audio
+
+            try:
+                disk = self._scan()
+                if key in disk:
+                    path = self._path(key)
+                    with open(path, "rb") as file:
+                        audio = file.read()
+                    # the modification time orders the files after a restart
+                    os.utime(path)
+                    disk.move_to_end(key)
+                    self._remember(key, audio)
+                    self.disk_hits += 1
+                    return audio
+            except OSError as error:
+                print("Could not read the audio cache:", error)
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, voice: str, audio_format: str,
+            audio: bytes) -> None:
+        """ Stores the audio of a text in both tiers.
+
+        Args:
+            text (str): the text spoken.
+            voice (str): the name of the voice.
+            audio_format (str): the output format of the audio.
+            audio (bytes): the synthesized audio.
+        """
+
+        if not audio:
+            return
+        key = self.key(text, voice, audio_format)
+        with self._lock:
+            self._remember(key, audio)
+            if len(audio) > self.disk_bytes:
+                return
+            try:
+                disk = self._scan()
+                path = self._path(key)
+                # written to a temporary file first, so readers never see a
+                # partial file
+                with open(path + ".tmp", "wb") as file:
+                    file.write(audio)
+                os.replace(path + ".tmp", path)
+                self._disk_size += len(audio) - disk.pop(key, 0)
+                disk[key] = len(audio)
+                while self._disk_size > self.disk_bytes:
+                    old_key, size = disk.popitem(last=False)
+                    self._disk_size -= size
+                    os.remove(self._path(old_key))
+            except OSError as error:
+                print("Could not write the audio cache:", error)
+
+    def _remember(self, key: str, audio: bytes) -> None:
+        if len(audio) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        self._memory[key] = audio
+        self._memory_size += len(audio)
+        while self._memory_size > self.memory_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_size -= len(old)
+
+    def stats(self) -> dict:
+        """ Returns the hit and miss counters of the cache.
+
+        Returns:
+            dict: the number of memory hits, disk hits and misses.
+        """
+
+        with self._lock:
+            return {"memory_hits": self.memory_hits,
+                    "disk_hits": self.disk_hits,
+                    "misses": self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_audio_cache() -> AudioCache:
+    """ Returns the process-wide audio cache, creating it on first use from
+    the AUDIO_CACHE_* environment variables.
+
+    Returns:
+        AudioCache: the shared audio cache.
+    """
+
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            load_dotenv()
+            _cache = AudioCache(
+                os.getenv("AUDIO_CACHE_PATH", "data/audio"),
+                memory_bytes=int(os.getenv("AUDIO_CACHE_MEMORY_BYTES",
+                                           str(16 * 2 ** 20))),
+                disk_bytes=int(os.getenv("AUDIO_CACHE_DISK_BYTES",
+                                         str(256 * 2 ** 20))))
+        return _cache
@@ -0,0 +1,141 @@
+""" This module builds the Azure AI and Azure OpenAI clients once per process
+from the .env configuration, and hands out the same instances to every
+caller so their pooled HTTP connections are reused across calls and threads.
+"""
+
+import os
+import threading
+from collections.abc import Callable
+from typing import Any
+
+import azure.cognitiveservices.speech as speech_sdk
+import httpx
+import requests
+from azure.ai.textanalytics import TextAnalyticsClient
+from azure.ai.translation.text import TextTranslationClient
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import RequestsTransport
+from dotenv import load_dotenv
+from openai import AsyncAzureOpenAI, AzureOpenAI
+from requests.adapters import HTTPAdapter
+
+# keep-alive connections kept open per host
+POOL_SIZE = 32
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(name: str, build: Callable[[], Any]) -> Any:
+    """ Returns the client registered under the given name, building it on
+    first use.
+
+    Args:
+        name (str): the name of the client.
+        build (callable): builds the client.
+
+    Returns:
+        Any: the shared client.
+    """
+
+    with _clients_lock:
+        if name not in _clients:
+            load_dotenv()
+            _clients[name] = build()
+        return _clients[name]
+
+
+def build_azure_transport() -> RequestsTransport:
+    """ Builds an HTTP transport for the Azure AI clients whose connection pool
+    is sized for concurrent calls.
+
+    Returns:
+        RequestsTransport: the HTTP transport.
+    """
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    return RequestsTransport(session=session, session_owner=False)
+
+
+def get_translator_client() -> TextTranslationClient:
+    """ Returns the shared Azure AI Translator client.
+
+    Returns:
+        TextTranslationClient: the Azure AI Translator client.
+    """
+
+    return get_client("translator", lambda: TextTranslationClient(
+        credential=AzureKeyCredential(os.getenv('TRANSLATOR_KEY')),
+        endpoint=os.getenv('TRANSLATOR_ENDPOINT'),
+        region=os.getenv('TRANSLATOR_REGION'),
+        transport=build_azure_transport()))
+
+
+def get_text_analytics_client() -> TextAnalyticsClient:
+    """ Returns the shared Azure AI Language text analytics client.
+
+    Returns:
+        TextAnalyticsClient: the Azure AI text analytics client.
+    """
+
+    return get_client("text_analytics", lambda: TextAnalyticsClient(
+        endpoint=os.getenv('LANGUAGE_ENDPOINT'),
+        credential=AzureKeyCredential(os.getenv('LANGUAGE_KEY')),
+        transport=build_azure_transport()))
+
+
+def get_speech_config() -> speech_sdk.SpeechConfig:
+    """ Returns the shared Azure AI Speech configuration.
+
+    Returns:
+        SpeechConfig: the speech client credentials.
+    """
+
+    return get_client("speech", lambda: speech_sdk.SpeechConfig(
+        os.getenv('SPEECH_KEY'), os.getenv('SPEECH_REGION')))
+
+
+def get_openai_client() -> AzureOpenAI:
+    """ Returns the shared Azure OpenAI client.
+
+    Returns:
+        AzureOpenAI: the Azure OpenAI client.
+    """
+
+    return get_client("openai", lambda: AzureOpenAI(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_KEY"),
+        api_version=os.getenv("OPENAI_API_VERSION"),
+        http_client=httpx.Client(limits=httpx.Limits(
+            max_connections=POOL_SIZE,
+            max_keepalive_connections=POOL_SIZE))))
+
+
+def get_async_openai_client() -> AsyncAzureOpenAI:
+    """ Returns the shared async Azure OpenAI client of
+    run_multiturn_conversation_async, for use from a single event loop.
+
+    Returns:
+        AsyncAzureOpenAI: the async Azure OpenAI client.
+    """
+
+    return get_client("async_openai", lambda: AsyncAzureOpenAI(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_KEY"),
+        api_version=os.getenv("OPENAI_API_VERSION"),
+        http_client=httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=POOL_SIZE,
+            max_keepalive_connections=POOL_SIZE))))
+
+
+def get_model_name() -> str:
+    """ Returns the Azure OpenAI model's deployment name.
+
+    Returns:
+        str: the OpenAI model name.
+    """
+
+    load_dotenv()
+    return os.getenv("MODEL_NAME")
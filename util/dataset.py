@@ -0,0 +1,596 @@
+""" This module downloads the MIND news dataset and loads its news articles
+and engagements into polars DataFrames.
+"""
+
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import BinaryIO
+from zipfile import ZipFile
+
+import polars as pl
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+# the MIND dataset's size and split, the test splits have no click labels
+DATASET_VARIANTS = ("MINDsmall_dev", "MINDsmall_train", "MINDlarge_dev",
+                    "MINDlarge_train")
+DATASET_VARIANT = os.getenv("DATASET_VARIANT", "MINDsmall_dev")
+if DATASET_VARIANT not in DATASET_VARIANTS:
+    raise ValueError("DATASET_VARIANT must be one of " +
+                     ", ".join(DATASET_VARIANTS))
+# "memory" reads the dataset into memory, "lazy" scans it out of core so
+# the engagements of MIND-large are counted in bounded memory
+DATASET_BACKEND = os.getenv("DATASET_BACKEND", "memory")
+if DATASET_BACKEND not in ("memory", "lazy"):
+    raise ValueError("DATASET_BACKEND must be memory or lazy, not " +
+                     DATASET_BACKEND)
+
+DATASET_URL = "https://mind201910small.blob.core.windows.net/release/" + \
+    DATASET_VARIANT + ".zip"
+DATASET_DIRECTORY = "data/" + DATASET_VARIANT
+# the only files of the archive the app reads
+DATASET_MEMBERS = ("news.tsv", "behaviors.tsv")
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+DOWNLOAD_ATTEMPTS = 5
+
+NEWS_PATH = DATASET_DIRECTORY + "/news.tsv"
+BEHAVIORS_PATH = DATASET_DIRECTORY + "/behaviors.tsv"
+CACHE_SUFFIX = ".arrow"
+
+NEWS_SCHEMA = {"news_id" : pl.datatypes.String,
+               "category" : pl.datatypes.String,
+               "subcategory" : pl.datatypes.String,
+               "title" : pl.datatypes.String,
+               "abstract" : pl.datatypes.String,
+               "url" : pl.datatypes.String,
+               "title_entities" : pl.datatypes.String,
+               "abstract_entities" : pl.datatypes.String}
+
+BEHAVIORS_SCHEMA = {"impression_id" : pl.datatypes.Int64,
+                    "user_id" : pl.datatypes.String,
+                    "time" : pl.datatypes.String,
+                    "history" : pl.datatypes.String,
+                    "impressions" : pl.datatypes.String}
+
+# e.g. "11/15/2019 8:55:22 AM"
+BEHAVIORS_TIME_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+# the length of the time buckets clicks are counted in
+CLICK_BUCKET = "1h"
+
+# the news articles' columns the news functions read
+NEWS_COLUMNS = ["news_id", "category", "subcategory", "title", "abstract"]
+
+
+def download_news_articles(url: str = DATASET_URL,
+                           directory: str = DATASET_DIRECTORY) -> None:
+    """ Downloads the news articles dataset and extracts its news.tsv and
+    behaviors.tsv files.
+
+    The archive is streamed to disk in chunks, and an interrupted download
+    resumes where it stopped. It is verified against DATASET_SHA256 if set,
+    otherwise against the MD5 hash Azure Blob Storage reports, and every
+    extracted file against its CRC-32. With DATASET_MIRROR set to a local
+    copy of the archive, or of the directory it extracts to, nothing is
+    downloaded.
+
+    Args:
+        url (str): the URL of the dataset's zip archive.
+        directory (str): the directory the files are extracted to.
+    """
+
+    load_dotenv()
+    mirror = os.getenv("DATASET_MIRROR")
+    expected_sha256 = os.getenv("DATASET_SHA256")
+    os.makedirs(directory, exist_ok=True)
+
+    if mirror and os.path.isdir(mirror):
+        for member in DATASET_MEMBERS:
+            with open(os.path.join(mirror, member), "rb") as source:
+                write_atomically(os.path.join(directory, member), source)
+        return
+
+    if mirror:
+        archive = mirror
+    else:
+        archive = directory + ".zip"
+        if not os.path.isfile(archive):
+            download_file(url, archive)
+    if expected_sha256 and file_sha256(archive) != expected_sha256.lower():
+        if not mirror:
+            os.remove(archive)
+        raise ValueError("The checksum of " + archive + " doesn't match "
+                         "DATASET_SHA256")
+
+    with ZipFile(archive, "r") as zip_file:
+        names = zip_file.namelist()
+        for member in DATASET_MEMBERS:
+            name = next((name for name in names
+                         if name == member or name.endswith("/" + member)),
+                        None)
+            if name is None:
+                raise ValueError(archive + " has no " + member)
+            # reading a member to the end checks its CRC-32
+            with zip_file.open(name) as source:
+                write_atomically(os.path.join(directory, member), source)
+
+
+def download_file(url: str, path: str) -> None:
+    """ Streams a file to disk, resuming an interrupted download with an
+    HTTP range request, and checks its size and MD5 hash when the server
+    reports them.
+
+    Args:
+        url (str): the URL of the file.
+        path (str): where to save the file.
+    """
+
+    partial_path = path + ".part"
+    etag_path = partial_path + ".etag"
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        offset = os.path.getsize(partial_path) \
+            if os.path.isfile(partial_path) else 0
+        headers = {}
+        if offset:
+            headers["Range"] = "bytes=" + str(offset) + "-"
+            # the rest is only sent if the file didn't change meanwhile,
+            # otherwise the whole file is
+            if os.path.isfile(etag_path):
+                with open(etag_path) as file:
+                    headers["If-Range"] = file.read()
+        try:
+            with requests.get(url, headers=headers, stream=True,
+                              allow_redirects=True, timeout=60) as response:
+                # "bytes 100-199/1000" for a range, "bytes */1000" when the
+                # file is already complete
+                size = response.headers.get("Content-Range", "").rpartition(
+                    "/")[2] or response.headers.get("Content-Length")
+                # the MD5 hash of the whole file, Content-MD5 is only the
+                # hash of a whole response
+                md5 = response.headers.get("x-ms-blob-content-md5")
+                if response.status_code == 416:
+                    break
+                response.raise_for_status()
+                if response.status_code != 206:
+                    offset = 0
+                    md5 = md5 or response.headers.get("Content-MD5")
+                if "ETag" in response.headers:
+                    with open(etag_path, "w") as file:
+                        file.write(response.headers["ETag"])
+                with open(partial_path, "ab" if offset else "wb") as file:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        file.write(chunk)
+            break
+        except requests.RequestException as error:
+            if attempt == DOWNLOAD_ATTEMPTS - 1:
+                raise
+            print("Download interrupted, resuming:", error)
+
+    if size and size.isdigit() and \
+            os.path.getsize(partial_path) != int(size):
+        raise ValueError("Downloaded " + str(os.path.getsize(partial_path)) +
+                         " bytes of " + url + " instead of " + size)
+    if md5 and base64.b64decode(md5).hex() != file_digest(partial_path,
+                                                          "md5"):
+        os.remove(partial_path)
+        raise ValueError("The MD5 hash of " + url + " doesn't match")
+    os.replace(partial_path, path)
+    if os.path.isfile(etag_path):
+        os.remove(etag_path)
+
+
+def write_atomically(path: str, source: BinaryIO) -> None:
+    """ Copies a file object to a path in chunks, through a temporary file
+    so readers never see a partially written file.
+
+    Args:
+        path (str): the destination path.
+        source (BinaryIO): the file object to copy.
+    """
+
+    with open(path + ".tmp", "wb") as file:
+        shutil.copyfileobj(source, file, DOWNLOAD_CHUNK_SIZE)
+    os.replace(path + ".tmp", path)
+
+
+def file_digest(path: str, algorithm: str) -> str:
+    """ Computes the hash of a file's content.
+
+    Args:
+        path (str): the path of the file.
+        algorithm (str): the name of the hash algorithm, e.g. "sha256".
+
+    Returns:
+        str: the hex digest of the file's content.
+    """
+
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    """ Computes the SHA-256 hash of a file's content.
+
+    Args:
+        path (str): the path of the file.
+
+    Returns:
+        str: the hex digest of the file's content.
+    """
+
+    return file_digest(path, "sha256")
+
+
+def temporary_path(path: str) -> str:
+    """ Creates an empty temporary file next to a path, with a unique name so
+    that processes writing the same file at once don't share it.
+
+    Args:
+        path (str): the path the temporary file will replace.
+
+    Returns:
+        str: the path of the temporary file.
+    """
+
+    directory, name = os.path.split(path)
+    descriptor, temporary = tempfile.mkstemp(suffix=".tmp", prefix=name + ".",
+                                             dir=directory or ".")
+    os.close(descriptor)
+    return temporary
+
+
+def remove_cached_frame(path: str) -> None:
+    """ Deletes the Arrow IPC cache of a TSV file and its metadata, e.g.
+    because the cache is damaged, so the TSV file is parsed again.
+
+    Args:
+        path (str): the path of the TSV file.
+    """
+
+    print("Discarding the damaged dataset cache of", path)
+    for cache_path in (path + CACHE_SUFFIX + ".json", path + CACHE_SUFFIX):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(cache_path)
+
+
+def cached_frame_path(path: str) -> str | None:
+    """ Returns the path of the Arrow IPC cache of a TSV file if it is up to
+    date.
+
+    The cache is up to date when the TSV's content hash matches the one
+    recorded when the cache was written. The hash is only recomputed when
+    the TSV's size or modification time changed.
+
+    Args:
+        path (str): the path of the TSV file.
+
+    Returns:
+        str | None: the path of the cache, or None if there's no cache or it
+            is stale.
+    """
+
+    cache_path = path + CACHE_SUFFIX
+    try:
+        with open(cache_path + ".json") as file:
+            metadata = json.load(file)
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+
+    if (stat.st_size, stat.st_mtime_ns) != (metadata["size"],
+                                            metadata["mtime_ns"]):
+        if file_sha256(path) != metadata["sha256"]:
+            return None
+        # same content with a new mtime, don't hash it again next time
+        write_cache_metadata(path, metadata["sha256"])
+    return cache_path
+
+
+def read_cached_frame(path: str) -> pl.DataFrame | None:
+    """ Reads the Arrow IPC cache of a TSV file if it is up to date.
+
+    Args:
+        path (str): the path of the TSV file.
+
+    Returns:
+        DataFrame | None: the cached DataFrame, or None if there's no cache
+            or it is stale.
+    """
+
+    cache_path = cached_frame_path(path)
+    if cache_path is None:
+        return None
+    try:
+        # an uncompressed IPC file is read without parsing or decompressing
+        return pl.read_ipc(cache_path)
+    except (OSError, pl.exceptions.PolarsError):
+        # the TSV file is the source of truth, a damaged cache is rebuilt
+        remove_cached_frame(path)
+        return None
+
+
+def scan_tsv(path: str, schema: dict, n_rows: int | None = None) -> \
+        pl.LazyFrame:
+    """ Scans a TSV file lazily, or its Arrow IPC cache if it is up to date,
+    so only the columns and rows a query needs are read.
+
+    Args:
+        path (str): the path of the TSV file.
+        schema (dict): the columns of the TSV file.
+        n_rows (int | None): the number of rows to scan, or None for all of
+            them. The cache is only used for all of them.
+
+    Returns:
+        LazyFrame: a polars LazyFrame with the content of the file.
+    """
+
+    if n_rows is None:
+        cache_path = cached_frame_path(path)
+        if cache_path is not None:
+            try:
+                # reads only the footer, which is lost if the file is cut
+                pl.read_ipc_schema(cache_path)
+                return pl.scan_ipc(cache_path)
+            except (OSError, pl.exceptions.PolarsError):
+                remove_cached_frame(path)
+    return pl.scan_csv(path,
+                       separator="\t",
+                       has_header=False,
+                       schema=schema,
+                       ignore_errors=True,
+                       n_rows=n_rows)
+
+
+def write_cache_metadata(path: str, sha256: str) -> None:
+    """ Records the content hash, size and modification time of a TSV file
+    next to its Arrow IPC cache.
+
+    Args:
+        path (str): the path of the TSV file.
+        sha256 (str): the content hash of the TSV file.
+    """
+
+    stat = os.stat(path)
+    metadata_path = path + CACHE_SUFFIX + ".json"
+    temporary = temporary_path(metadata_path)
+    try:
+        with open(temporary, "w") as file:
+            json.dump({"sha256": sha256,
+                       "size": stat.st_size,
+                       "mtime_ns": stat.st_mtime_ns}, file)
+        os.replace(temporary, metadata_path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def write_cached_frame(path: str,
+                       frame: pl.DataFrame | pl.LazyFrame) -> None:
+    """ Writes the parsed DataFrame of a TSV file to an uncompressed Arrow IPC
+    file next to it, so later loads don't parse it again. A LazyFrame is
+    streamed to the file without being collected in memory.
+
+    Args:
+        path (str): the path of the TSV file.
+        frame (DataFrame | LazyFrame): the parsed content of the TSV file.
+    """
+
+    cache_path = path + CACHE_SUFFIX
+    temporary = None
+    try:
+        sha256 = file_sha256(path)
+        # each process writes its own temporary file, and the cache is
+        # replaced before its metadata, so a reader never pairs the new hash
+        # with an old or partially written cache file
+        temporary = temporary_path(cache_path)
+        if isinstance(frame, pl.LazyFrame):
+            frame.sink_ipc(temporary, compression="uncompressed",
+                           engine="streaming")
+        else:
+            frame.write_ipc(temporary, compression="uncompressed")
+        os.replace(temporary, cache_path)
+        write_cache_metadata(path, sha256)
+    except (OSError, pl.exceptions.PolarsError) as error:
+        print("Could not write the dataset cache:", error)
+    finally:
+        if temporary is not None and os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def load_news_articles(path: str = NEWS_PATH) -> pl.DataFrame:
+    """ Loads the news articles and returns them in a polars DataFrame.
+
+    Args:
+        path (str): the path of the news.tsv file.
+
+    Returns:
+        DataFrame: a polars DataFrame with the news articles.
+    """
+
+    if not os.path.isfile(path):
+        download_news_articles()
+
+    news_lf = read_cached_frame(path)
+    if news_lf is not None:
+        return news_lf
+
+    news_lf = pl.read_csv(path,
+                       separator="\t",
+                       has_header=False,
+                       schema=NEWS_SCHEMA,
+                        ignore_errors=True)
+
+    news_lf = news_lf.with_columns(
+        pl.col("abstract").fill_null("No abstract")
+    )
+    write_cached_frame(path, news_lf)
+    return news_lf
+
+
+def load_news_article_engagement(path: str = BEHAVIORS_PATH) -> pl.DataFrame:
+    """ Loads the article engagements and returns them in a polars DataFrame.
+
+    Args:
+        path (str): the path of the behaviors.tsv file.
+
+    Returns:
+        DataFrame: a polars DataFrame with the news article engagements.
+    """
+
+    if not os.path.isfile(path):
+        download_news_articles()
+
+    # the app only reads the engagements through the engagement table, so
+    # they aren't cached as Arrow IPC like the news articles
+    behaviors_lf = pl.read_csv(path,
+                       separator="\t",
+                       has_header=False,
+                       schema=BEHAVIORS_SCHEMA,
+                        ignore_errors=True)
+
+    return behaviors_lf
+
+
+def scan_news_articles(path: str = NEWS_PATH) -> pl.LazyFrame:
+    """ Scans the news articles lazily, for the out-of-core backend.
+
+    Args:
+        path (str): the path of the news.tsv file.
+
+    Returns:
+        LazyFrame: a polars LazyFrame with the news articles.
+    """
+
+    if not os.path.isfile(path):
+        download_news_articles()
+
+    return scan_tsv(path, NEWS_SCHEMA).with_columns(
+        pl.col("abstract").fill_null("No abstract")
+    )
+
+
+def scan_news_article_engagement(path: str = BEHAVIORS_PATH,
+                                 n_rows: int | None = None) -> pl.LazyFrame:
+    """ Scans the article engagements lazily, for the out-of-core backend.
+
+    Args:
+        path (str): the path of the behaviors.tsv file.
+        n_rows (int | None): the number of engagements to scan, or None for
+            all of them.
+
+    Returns:
+        LazyFrame: a polars LazyFrame with the news article engagements.
+    """
+
+    if not os.path.isfile(path):
+        download_news_articles()
+
+    return scan_tsv(path, BEHAVIORS_SCHEMA, n_rows)
+
+
+def compact_news_articles(
+        news_lf: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    """ Builds a compact copy of the news articles for keeping in memory.
+
+    Only the columns the news functions read are kept, and news_id, category
+    and subcategory become Categorical: each value is stored once in a
+    process-wide dictionary and the columns hold its integer code, so
+    filters and joins on them compare integers.
+
+    The copy is private to the process: it isn't backed by the Arrow IPC
+    cache, so processes serving the app don't share its pages, and each one
+    trades that for a smaller frame and faster joins.
+
+    Args:
+        news_lf (DataFrame | LazyFrame): the news articles.
+
+    Returns:
+        DataFrame: the compact news articles.
+    """
+
+    return news_lf.lazy().select(NEWS_COLUMNS).with_columns(
+        pl.col("news_id", "category", "subcategory").cast(pl.Categorical)
+    ).collect(engine="streaming")
+
+
+def count_article_engagement(
+        behaviors_lf: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    """ Counts the impressions and clicks of every news article shown in the
+    engagements. A LazyFrame is counted with the streaming engine, which
+    only reads its impressions column and keeps only the counts in memory.
+
+    Args:
+        behaviors_lf (DataFrame | LazyFrame): the article engagements.
+
+    Returns:
+        DataFrame: a new DataFrame with news_id, click and impression counts.
+    """
+
+    # one row per "<news_id>-<label>" impression, label 1 means clicked
+    return behaviors_lf.lazy().select(
+        pl.col("impressions").str.split(" ")
+    ).explode("impressions").select(
+        pl.col("impressions").str.head(-2).alias("news_id"),
+        pl.col("impressions").str.tail(1).alias("label"),
+    ).filter(
+        pl.col("news_id").is_not_null()
+    ).group_by("news_id", maintain_order=True).agg(
+        pl.col("label").cast(pl.Int64).sum().alias("clicks"),
+        pl.len().cast(pl.Int64).alias("impressions")
+    ).collect(engine="streaming")
+
+
+
+def count_bucketed_clicks(
+        behaviors_lf: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    """ Counts the clicks of every news article in every hour of the
+    engagements.
+
+    Args:
+        behaviors_lf (DataFrame | LazyFrame): the article engagements.
+
+    Returns:
+        DataFrame: a new DataFrame with the start of the hour, news_id and
+            click count of every news article clicked in each hour.
+    """
+
+    return behaviors_lf.lazy().select(
+        pl.col("time").str.strptime(
+            pl.Datetime, BEHAVIORS_TIME_FORMAT, strict=False
+        ).dt.truncate(CLICK_BUCKET).alias("hour"),
+        pl.col("impressions").str.split(" ")
+    ).explode("impressions").filter(
+        pl.col("hour").is_not_null() &
+        pl.col("impressions").str.ends_with("-1")
+    ).group_by(
+        pl.col("hour"),
+        pl.col("impressions").str.head(-2).alias("news_id"),
+        maintain_order=True
+    ).agg(
+        pl.len().cast(pl.Int64).alias("clicks")
+    ).collect(engine="streaming")
+
+
+if __name__ == "__main__":
+    from util.store import NewsStore
+
+    # converts news.tsv to its Arrow IPC cache ahead of time
+    if DATASET_BACKEND == "lazy":
+        # streamed to the cache without loading the file in memory
+        if not os.path.isfile(NEWS_PATH):
+            download_news_articles()
+        if cached_frame_path(NEWS_PATH) is None:
+            write_cached_frame(NEWS_PATH, scan_tsv(NEWS_PATH, NEWS_SCHEMA))
+    else:
+        load_news_articles()
+    # counts the engagements of behaviors.tsv into the engagement table,
+    # which is what the app reads
+    NewsStore().current_version()
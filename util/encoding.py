@@ -0,0 +1,96 @@
+""" This module encodes the news functions' responses in a compact format, to
+spend as few prompt tokens as possible on them, and keeps count of the tokens
+each function returns.
+"""
+
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from util.history import count_tokens
+
+load_dotenv()
+# "tsv" for a header and one tab-separated line per article, or "text" for
+# the original 'Title: "...", ID: "..."' sentences
+TOOL_RESPONSE_FORMAT = os.getenv("TOOL_RESPONSE_FORMAT", "tsv")
+# abstracts longer than this are truncated, 0 keeps them whole
+TOOL_ABSTRACT_CHARS = int(os.getenv("TOOL_ABSTRACT_CHARS", "0"))
+
+TEXT_LABELS = {"id": "ID", "title": "Title", "abstract": "Abstract",
+               "score": "Match score"}
+
+
+def encode_rows(columns: list[str], rows: list[tuple]) -> str:
+    """ Encodes the rows of a news function's response.
+
+    Args:
+        columns (list[str]): the name of each column, e.g. "id" or "title".
+        rows (list[tuple]): the rows, with a value for each column.
+
+    Returns:
+        str: the rows in the TOOL_RESPONSE_FORMAT format.
+    """
+
+    if TOOL_RESPONSE_FORMAT == "text":
+        return ". ".join(
+            ", ".join(TEXT_LABELS[column] + ": \"" + value + "\""
+                      for column, value in zip(columns, row))
+            for row in rows)
+
+    lines = ["\t".join(columns)]
+    for row in rows:
+        lines.append("\t".join(" ".join(value.split()) for value in row))
+    return "\n".join(lines)
+
+
+def truncate_abstract(abstract: str) -> str:
+    """ Truncates an abstract to TOOL_ABSTRACT_CHARS characters, at a word
+    boundary.
+
+    Args:
+        abstract (str): the abstract.
+
+    Returns:
+        str: the abstract, truncated if it is longer than the limit.
+    """
+
+    if not TOOL_ABSTRACT_CHARS or len(abstract) <= TOOL_ABSTRACT_CHARS:
+        return abstract
+    return abstract[:TOOL_ABSTRACT_CHARS].rsplit(" ", 1)[0] + "..."
+
+
+_token_stats = {}
+_token_stats_lock = threading.Lock()
+
+
+def record_tool_tokens(function_name: str, response: str) -> int:
+    """ Counts the tokens of a function's response and adds them to the
+    function's totals.
+
+    Args:
+        function_name (str): the name of the function.
+        response (str): the function's response.
+
+    Returns:
+        int: the number of tokens of the response.
+    """
+
+    tokens = count_tokens(response)
+    with _token_stats_lock:
+        stats = _token_stats.setdefault(function_name,
+                                        {"calls": 0, "tokens": 0})
+        stats["calls"] += 1
+        stats["tokens"] += tokens
+    return tokens
+
+
+def get_tool_token_stats() -> dict:
+    """ Returns the number of calls and response tokens of every function.
+
+    Returns:
+        dict: a dictionary from function name to its calls and tokens.
+    """
+
+    with _token_stats_lock:
+        return {name: dict(stats) for name, stats in _token_stats.items()}
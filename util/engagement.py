@@ -0,0 +1,246 @@
+""" This module maintains a persisted table with the click and impression
+counts of every news article, updated incrementally as behaviors.tsv grows.
+"""
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+from collections.abc import Callable
+
+import polars as pl
+
+from util.dataset import (
+    BEHAVIORS_PATH,
+    BEHAVIORS_SCHEMA,
+    DATASET_BACKEND,
+    count_article_engagement,
+    count_bucketed_clicks,
+    scan_news_article_engagement,
+    temporary_path,
+)
+
+# bytes at the start of behaviors.tsv used to tell an appended file from a
+# replaced one
+HEAD_SIZE = 1 << 16
+
+# the ids and categories are dictionary-encoded like the news articles', see
+# compact_news_articles
+ENGAGEMENT_SCHEMA = {"news_id": pl.datatypes.Categorical,
+                     "category": pl.datatypes.Categorical,
+                     "clicks": pl.datatypes.Int64,
+                     "impressions": pl.datatypes.Int64}
+
+HOURLY_CLICKS_SCHEMA = {"hour": pl.datatypes.Datetime("us"),
+                        "news_id": pl.datatypes.Categorical,
+                        "clicks": pl.datatypes.Int64}
+
+
+def read_head_sha256(path: str, size: int) -> str:
+    """ Computes the SHA-256 hash of the first bytes of a file.
+
+    Args:
+        path (str): the path of the file.
+        size (int): the number of bytes to hash.
+
+    Returns:
+        str: the hex digest of the first bytes of the file.
+    """
+
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read(size)).hexdigest()
+
+
+def replace_file(path: str, write: Callable[[str], None]) -> None:
+    """ Writes a file through a temporary file with a unique name, so readers
+    never see it partially written, even with several processes writing it.
+
+    Args:
+        path (str): the path of the file.
+        write (callable): writes the content to the given path.
+    """
+
+    temporary = temporary_path(path)
+    try:
+        write(temporary)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def write_json(path: str, content: dict) -> None:
+    """ Writes a dictionary to a JSON file.
+
+    Args:
+        path (str): the path of the file.
+        content (dict): the dictionary to write.
+    """
+
+    with open(path, "w") as file:
+        json.dump(content, file)
+
+
+def count_complete_lines(path: str) -> tuple[int, int]:
+    """ Counts the complete lines of a file, reading it in blocks.
+
+    Args:
+        path (str): the path of the file.
+
+    Returns:
+        tuple[int, int]: the number of complete lines, and the byte offset
+            where the last one ends.
+    """
+
+    lines = 0
+    end = 0
+    offset = 0
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            count = block.count(b"\n")
+            if count:
+                lines += count
+                end = offset + block.rfind(b"\n") + 1
+            offset += len(block)
+    return lines, end
+
+
+class EngagementTable:
+    """ The news_id, category, clicks and impressions of every news article
+    shown in behaviors.tsv, saved next to it with the byte offset up to which
+    the file has been processed.
+
+    The clicks of every news article in every hour are kept the same way in
+    `hourly_clicks`, for the trending news.
+
+    behaviors.tsv is expected to only grow by appending lines. If it shrinks
+    or its first bytes change, the tables are rebuilt from scratch.
+    """
+
+    def __init__(self, behaviors_path: str = BEHAVIORS_PATH):
+        self.behaviors_path = behaviors_path
+        directory = os.path.dirname(behaviors_path)
+        self.table_path = os.path.join(directory, "engagement.arrow")
+        self.state_path = os.path.join(directory, "engagement.json")
+        self.hourly_path = os.path.join(directory, "engagement_hourly.arrow")
+        self.table = pl.DataFrame(schema=ENGAGEMENT_SCHEMA)
+        self.hourly_clicks = pl.DataFrame(schema=HOURLY_CLICKS_SCHEMA)
+        self.offset = 0
+        self.head_sha256 = None
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.state_path) as file:
+                state = json.load(file)
+            table = pl.read_ipc(self.table_path).cast(ENGAGEMENT_SCHEMA)
+            hourly_clicks = pl.read_ipc(self.hourly_path).cast(
+                HOURLY_CLICKS_SCHEMA)
+        except (OSError, ValueError, KeyError, pl.exceptions.PolarsError):
+            # a missing or damaged table is rebuilt from the start of
+            # behaviors.tsv
+            return
+        self.table = table
+        self.hourly_clicks = hourly_clicks
+        self.offset = state["offset"]
+        self.head_sha256 = state["head_sha256"]
+
+    def _save(self) -> None:
+        # replace the table before the state, so the saved offset never
+        # points past the counts saved with it
+        try:
+            replace_file(self.table_path, self.table.write_ipc)
+            replace_file(self.hourly_path, self.hourly_clicks.write_ipc)
+            replace_file(self.state_path, lambda path: write_json(
+                path, {"offset": self.offset,
+                       "head_sha256": self.head_sha256}))
+        except (OSError, pl.exceptions.PolarsError) as error:
+            print("Could not save the engagement table:", error)
+            # without the state the saved tables are rebuilt, instead of
+            # pairing new counts with an old offset
+            with contextlib.suppress(OSError):
+                os.remove(self.state_path)
+
+    def _read_new_behaviors(self) -> pl.DataFrame:
+        with open(self.behaviors_path, "rb") as file:
+            file.seek(self.offset)
+            chunk = file.read()
+        # leave a partially written last line for the next refresh
+        end = chunk.rfind(b"\n") + 1
+        self.offset += end
+        if end == 0:
+            return pl.DataFrame(schema=BEHAVIORS_SCHEMA)
+        return pl.read_csv(io.BytesIO(chunk[:end]),
+                           separator="\t",
+                           has_header=False,
+                           schema=BEHAVIORS_SCHEMA,
+                           ignore_errors=True)
+
+    def refresh(self, news_lf: pl.DataFrame) -> bool:
+        """ Merges the engagements appended to behaviors.tsv since the last
+        refresh into the tables, and updates the articles' categories.
+
+        Args:
+            news_lf (DataFrame): a DataFrame with all the news articles.
+
+        Returns:
+            bool: True if the table changed, otherwise False.
+        """
+
+        size = os.stat(self.behaviors_path).st_size
+        head_sha256 = read_head_sha256(self.behaviors_path,
+                                       min(self.offset, HEAD_SIZE))
+        if size < self.offset or head_sha256 != self.head_sha256:
+            self.table = pl.DataFrame(schema=ENGAGEMENT_SCHEMA)
+            self.hourly_clicks = pl.DataFrame(schema=HOURLY_CLICKS_SCHEMA)
+            self.offset = 0
+
+        previous_offset = self.offset
+        if DATASET_BACKEND == "lazy" and self.offset == 0:
+            # the whole file is streamed instead of read in memory, up to
+            # its last complete line
+            lines, self.offset = count_complete_lines(self.behaviors_path)
+            behaviors_lf = scan_news_article_engagement(self.behaviors_path,
+                                                        lines)
+        else:
+            behaviors_lf = self._read_new_behaviors()
+        new_counts = count_article_engagement(behaviors_lf)
+        new_hourly_clicks = count_bucketed_clicks(behaviors_lf)
+        self.head_sha256 = read_head_sha256(self.behaviors_path,
+                                            min(self.offset, HEAD_SIZE))
+
+        counts = pl.concat([
+            self.table.select("news_id", "clicks", "impressions"),
+            new_counts.with_columns(pl.col("news_id").cast(pl.Categorical))
+        ]).group_by("news_id", maintain_order=True).agg(
+            pl.col("clicks").sum(),
+            pl.col("impressions").sum()
+        )
+
+        # news.tsv may repeat an id, keep the first category like a lookup
+        # would
+        categories = news_lf.lazy().select(
+            pl.col("news_id").cast(pl.Categorical),
+            pl.col("category").cast(pl.Categorical)
+        ).unique(subset="news_id", keep="first", maintain_order=True)
+
+        table = counts.lazy().join(
+            categories, on="news_id", how="left", maintain_order="left"
+        ).select(list(ENGAGEMENT_SCHEMA)).collect()
+
+        if self.offset == previous_offset and table.equals(self.table):
+            return False
+        self.table = table
+        if new_hourly_clicks.height:
+            self.hourly_clicks = pl.concat([
+                self.hourly_clicks,
+                new_hourly_clicks.cast(HOURLY_CLICKS_SCHEMA)
+            ]).group_by("hour", "news_id", maintain_order=True).agg(
+                pl.col("clicks").sum()
+            )
+        try:
+            self._save()
+        except OSError as error:
+            print("Could not save the engagement table:", error)
+        return True
@@ -0,0 +1,150 @@
+""" This module keeps the conversation history sent to Azure OpenAI within a
+token budget, so the size and latency of each request stay flat however long
+the conversation goes on.
+"""
+
+import functools
+import os
+import threading
+
+from dotenv import load_dotenv
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# tokens every message costs on top of its content
+MESSAGE_OVERHEAD = 4
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding():
+    """ Returns the tiktoken encoding used to count tokens, if tiktoken is
+    installed.
+
+    Returns:
+        Encoding | None: the encoding, or None to estimate token counts.
+    """
+
+    if tiktoken is None:
+        return None
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str | None) -> int:
+    """ Counts the tokens of a text, or estimates them at four characters per
+    token when tiktoken isn't installed.
+
+    Args:
+        text (str | None): the text.
+
+    Returns:
+        int: the number of tokens.
+    """
+
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(message: dict) -> int:
+    """ Counts the tokens a message of the conversation costs.
+
+    Args:
+        message (dict): the message.
+
+    Returns:
+        int: the number of tokens.
+    """
+
+    tokens = MESSAGE_OVERHEAD + count_tokens(message.get("content"))
+    for tool_call in message.get("tool_calls") or []:
+        tokens += count_tokens(tool_call["function"]["name"])
+        tokens += count_tokens(tool_call["function"]["arguments"])
+    return tokens
+
+
+class HistoryManager:
+    """ Compacts a conversation to fit a token budget.
+
+    The system prompt and the most recent turns are always kept. Tool
+    outputs of older turns are truncated first, and if the conversation is
+    still over budget its oldest turns are dropped.
+    """
+
+    def __init__(self, budget: int = 4000, recent_turns: int = 2,
+                 tool_output_chars: int = 200):
+        self.budget = budget
+        self.recent_turns = recent_turns
+        self.tool_output_chars = tool_output_chars
+
+    def compact(self, messages: list) -> list:
+        """ Compacts the conversation in place.
+
+        Args:
+            messages (list): the history of the conversation.
+
+        Returns:
+            list: the same list, compacted.
+        """
+
+        system = [message for message in messages[:1]
+                  if message["role"] == "system"]
+        # a turn starts with a user message and holds the replies and tool
+        # calls that follow it
+        turns = []
+        for message in messages[len(system):]:
+            if message["role"] == "user" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+
+        old_turns = turns[:-self.recent_turns] if self.recent_turns \
+            else turns
+        for turn in old_turns:
+            for position, message in enumerate(turn):
+                content = message.get("content")
+                if message["role"] == "tool" and content and \
+                        len(content) > self.tool_output_chars:
+                    turn[position] = dict(
+                        message,
+                        content=content[:self.tool_output_chars] +
+                        "... [truncated]")
+
+        tokens = sum(count_message_tokens(message)
+                     for message in system + [message for turn in turns
+                                              for message in turn])
+        while tokens > self.budget and len(turns) > self.recent_turns:
+            tokens -= sum(count_message_tokens(message)
+                          for message in turns.pop(0))
+
+        messages[:] = system + [message for turn in turns
+                                for message in turn]
+        return messages
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_history_manager() -> HistoryManager:
+    """ Returns the process-wide history manager, creating it on first use
+    from the HISTORY_* environment variables.
+
+    Returns:
+        HistoryManager: the shared history manager.
+    """
+
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            load_dotenv()
+            _manager = HistoryManager(
+                budget=int(os.getenv("HISTORY_TOKEN_BUDGET", "4000")),
+                recent_turns=int(os.getenv("HISTORY_RECENT_TURNS", "2")),
+                tool_output_chars=int(os.getenv("HISTORY_TOOL_OUTPUT_CHARS",
+                                                "200")))
+        return _manager
@@ -0,0 +1,292 @@
+""" This module builds the in-memory indexes the news functions use to answer
+their queries without running a DataFrame pipeline on every call.
+"""
+
+import re
+import unicodedata
+from collections import Counter
+from datetime import timedelta
+from typing import NamedTuple
+
+import polars as pl
+
+# an approximate title match only looks for candidates among the titles
+# sharing one of the query's rarest trigrams
+RARE_TRIGRAMS = 6
+MAX_TITLE_CANDIDATES = 32
+MIN_TITLE_SCORE = 0.5
+
+# the clicks of the trending news lose half their weight every this many
+# hours, and stop counting after TRENDING_HALF_LIVES of them
+TRENDING_HALF_LIFE = 6
+TRENDING_HALF_LIVES = 4
+
+
+class Article(NamedTuple):
+    """ The fields of a news article the news functions return. """
+
+    news_id: str
+    category: str
+    subcategory: str
+    title: str
+    abstract: str
+
+
+def build_article_index(news_lf: pl.DataFrame) -> dict[str, Article]:
+    """ Maps every news_id to its article, for constant-time lookups.
+
+    Args:
+        news_lf (DataFrame): a DataFrame with all the news articles.
+
+    Returns:
+        dict[str, Article]: a dictionary from news_id to article. If news_id
+            is repeated, the first article with it is kept.
+    """
+
+    index = {}
+    for row in news_lf.select(Article._fields).iter_rows():
+        index.setdefault(row[0], Article(*row))
+    return index
+
+
+def build_top_news_index(news_lf: pl.DataFrame,
+                         engagement_lf: pl.DataFrame) -> dict:
+    """ Ranks the clicked news articles of every category and every
+    (category, subcategory) pair by their number of clicks.
+
+    Ties are broken by news_id so the ranking is always the same.
+
+    Args:
+        news_lf (DataFrame): a DataFrame with all the news articles.
+        engagement_lf (DataFrame): a DataFrame with the news_id, category and
+            clicks of every news article.
+
+    Returns:
+        dict: a dictionary from a category, or a (category, subcategory)
+            tuple, to a list of (news_id, title, clicks) tuples, most clicked
+            first.
+    """
+
+    articles = news_lf.lazy().select(
+        pl.col("news_id"),
+        pl.col("subcategory"),
+        pl.col("title")
+    ).unique(subset="news_id", keep="first", maintain_order=True)
+
+    # the ids are joined as the articles encode them, e.g. as the codes of
+    # compact_news_articles
+    ranked = engagement_lf.lazy().filter(
+        (pl.col("clicks") > 0) & pl.col("category").is_not_null()
+    ).with_columns(
+        pl.col("news_id").cast(news_lf.schema["news_id"])
+    ).join(
+        articles, on="news_id", how="inner"
+    ).sort(
+        ["clicks", "news_id"], descending=[True, False]
+    ).select(
+        pl.col("category"),
+        pl.col("subcategory"),
+        pl.col("news_id"),
+        pl.col("title"),
+        pl.col("clicks")
+    ).collect()
+
+    index = {}
+    for category, subcategory, news_id, title, clicks in ranked.iter_rows():
+        article = (news_id, title, clicks)
+        index.setdefault(category, []).append(article)
+        # an article without a subcategory is only ranked in its category
+        if subcategory is not None:
+            index.setdefault((category, subcategory), []).append(article)
+    return index
+
+
+def normalize_title(title: str) -> str:
+    """ Normalizes a title so that titles differing only in case, accents,
+    punctuation or spacing are equal.
+
+    Args:
+        title (str): the title to normalize.
+
+    Returns:
+        str: the case-folded title, with accents and punctuation removed and
+            words separated by a single space.
+    """
+
+    title = unicodedata.normalize("NFKD", title.casefold())
+    title = "".join(char for char in title if not unicodedata.combining(char))
+    return " ".join(re.split(r"[\W_]+", title)).strip()
+
+
+def title_trigrams(normalized_title: str) -> set[str]:
+    """ Splits a normalized title into its character trigrams.
+
+    Args:
+        normalized_title (str): the title, normalized with normalize_title.
+
+    Returns:
+        set[str]: the title's character trigrams.
+    """
+
+    padded = " " + normalized_title + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """ Finds a news article by its title, even if the given title differs in
+    case or punctuation or is only approximately the same.
+
+    Titles are matched exactly first, then on their normalized form, and
+    finally by the similarity of their character trigrams.
+    """
+
+    def __init__(self, news_lf: pl.DataFrame):
+        self._exact = {}
+        self._normalized = {}
+        self._titles = []
+        self._trigrams = {}
+        rows = news_lf.select(
+            pl.col("title"),
+            pl.col("news_id")
+        ).drop_nulls().iter_rows()
+        for title, news_id in rows:
+            if title in self._exact:
+                continue
+            self._exact[title] = news_id
+            normalized = normalize_title(title)
+            if normalized in self._normalized:
+                continue
+            self._normalized[normalized] = news_id
+            position = len(self._titles)
+            self._titles.append((normalized, news_id))
+            for trigram in title_trigrams(normalized):
+                self._trigrams.setdefault(trigram, []).append(position)
+
+    def match(self, title: str) -> tuple[str, float] | None:
+        """ Finds the news article whose title best matches the given one.
+
+        Args:
+            title (str): the title to look for.
+
+        Returns:
+            tuple[str, float] | None: the news_id of the best match and its
+                score, from 1.0 for an exact or normalized match down to
+                MIN_TITLE_SCORE, or None if no title is similar enough.
+        """
+
+        if title in self._exact:
+            return self._exact[title], 1.0
+        normalized = normalize_title(title)
+        if normalized in self._normalized:
+            return self._normalized[normalized], 1.0
+
+        trigrams = title_trigrams(normalized)
+        postings = sorted(
+            (self._trigrams[trigram] for trigram in trigrams
+             if trigram in self._trigrams), key=len)
+        # the rarest trigrams are enough to find the candidates, and keep
+        # the cost of a lookup low however many titles share common ones
+        hits = Counter()
+        for posting in postings[:RARE_TRIGRAMS]:
+            hits.update(posting)
+
+        best = None
+        for position, _ in hits.most_common(MAX_TITLE_CANDIDATES):
+            candidate, news_id = self._titles[position]
+            candidate_trigrams = title_trigrams(candidate)
+            # Dice coefficient of both titles' trigrams
+            score = 2 * len(trigrams & candidate_trigrams) / (
+                len(trigrams) + len(candidate_trigrams))
+            if score >= MIN_TITLE_SCORE and (best is None or score > best[1]):
+                best = news_id, score
+        return best
+
+
+class TrendingIndex:
+    """ Ranks the news articles of a category by their clicks in the most
+    recent hours, from the hourly click counts, so a query only reads the
+    hours it covers however long the engagement log is.
+
+    The dataset is a recording, so the most recent hour is the last hour
+    with clicks rather than the current time.
+    """
+
+    def __init__(self, news_lf: pl.DataFrame, hourly_clicks: pl.DataFrame):
+        articles = news_lf.lazy().select(
+            pl.col("news_id"),
+            pl.col("category"),
+            pl.col("title")
+        ).unique(subset="news_id", keep="first", maintain_order=True)
+
+        clicks = hourly_clicks.lazy().with_columns(
+            pl.col("news_id").cast(news_lf.schema["news_id"])
+        ).join(
+            articles, on="news_id", how="inner"
+        ).filter(
+            pl.col("category").is_not_null()
+        ).sort("hour").collect()
+
+        self.now = clicks["hour"].max()
+        # the clicks of every category, sorted by hour
+        self._clicks = {
+            key[0]: frame
+            for key, frame in clicks.partition_by(
+                "category", as_dict=True, maintain_order=True).items()
+        }
+
+    def _recent_clicks(self, category: str, hours: float) -> pl.DataFrame:
+        clicks = self._clicks.get(category)
+        if clicks is None or self.now is None:
+            return pl.DataFrame()
+        start = self.now - timedelta(hours=hours)
+        return clicks.slice(clicks["hour"].search_sorted(start, side="right"))
+
+    def _rank(self, clicks: pl.DataFrame, score: pl.Expr,
+              number: int) -> list[tuple[str, str, float]]:
+        if clicks.is_empty():
+            return []
+        return clicks.group_by("news_id").agg(
+            pl.col("title").first(),
+            score.alias("score")
+        ).sort(
+            ["score", "news_id"], descending=[True, False]
+        ).head(number).rows()
+
+    def top(self, category: str, number: int,
+            hours: float) -> list[tuple[str, str, float]]:
+        """ Ranks the news articles of a category by their clicks in the most
+        recent hours.
+
+        Args:
+            category (str): the category of the news articles.
+            number (int): the number of news articles to return.
+            hours (float): the number of most recent hours to count.
+
+        Returns:
+            list[tuple[str, str, float]]: the (news_id, title, clicks) of
+                the most clicked news articles, most clicked first.
+        """
+
+        return self._rank(self._recent_clicks(category, hours),
+                          pl.col("clicks").sum().cast(pl.Float64), number)
+
+    def trending(self, category: str, number: int,
+                 half_life: float = TRENDING_HALF_LIFE) -> \
+            list[tuple[str, str, float]]:
+        """ Ranks the news articles of a category by their clicks, each
+        weighted less the older it is.
+
+        Args:
+            category (str): the category of the news articles.
+            number (int): the number of news articles to return.
+            half_life (float): the hours after which a click weighs half.
+
+        Returns:
+            list[tuple[str, str, float]]: the (news_id, title, score) of the
+                trending news articles, most trending first.
+        """
+
+        age = (pl.lit(self.now) - pl.col("hour")).dt.total_seconds() / 3600
+        return self._rank(
+            self._recent_clicks(category, TRENDING_HALF_LIVES * half_life),
+            (pl.col("clicks") * 0.5 ** (age / half_life)).sum(), number)
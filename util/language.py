@@ -6,6 +6,8 @@ AI Language Service.
 from azure.ai.textanalytics import TextAnalyticsClient
 from azure.ai.translation.text import TextTranslationClient
 
+from util.translation_cache import get_translation_cache
+
 
 def detect_language(client: TextAnalyticsClient, text: str) -> str:
     """ Detect the language of the provided text.
@@ -21,9 +23,15 @@ def detect_language(client: TextAnalyticsClient, text: str) -> str:
     return detected_language.primary_language.name
 
 
+# Azure AI Translator limits on a single request
+MAX_TRANSLATION_ELEMENTS = 1000
+MAX_TRANSLATION_CHARACTERS = 50_000
+
+
 def translate_text(client: TextTranslationClient,
                    text: str, target_lang: str) -> str:
-    """ Translate the given text to the target_lang.
+    """ Translate the given text to the target_lang. Translations are cached,
+    so only texts not translated before are sent to the translator.
 
     Args:
         client (TextTranslationClient): the Azure AI Translator client.
@@ -34,10 +42,62 @@ def translate_text(client: TextTranslationClient,
         str: the translated text.
     """
 
-    input_text_elements = [text]
-    translation_response = client.translate(
-        body=input_text_elements, to_language=[target_lang])
-    translation = translation_response[0] if translation_response else None
-    if translation:
-        for translated_text in translation.translations:
-            return translated_text.text
+    return translate_texts(client, [text], target_lang)[0]
+
+
+def translate_texts(client: TextTranslationClient,
+                    texts: list[str], target_lang: str) -> list[str]:
+    """ Translate several texts to the target_lang in as few requests as the
+    translator limits allow. Translations are cached, so only texts not
+    translated before are sent to the translator.
+
+    Args:
+        client (TextTranslationClient): the Azure AI Translator client.
+        texts (list[str]): the texts to translate.
+        target_lang (str): the target language to translate them to.
+
+    Returns:
+        list[str]: the translated texts, in the same order.
+    """
+
+    cache = get_translation_cache()
+    translations = {}
+    missing = []
+    for text in texts:
+        if text in translations or text in missing:
+            continue
+        cached_translation = cache.get(text, target_lang)
+        if cached_translation is not None:
+            translations[text] = cached_translation
+        else:
+            missing.append(text)
+
+    # split the missing texts into requests within the translator limits
+    batches = []
+    batch = []
+    characters = 0
+    for text in missing:
+        if batch and (len(batch) == MAX_TRANSLATION_ELEMENTS or
+                      characters + len(text) > MAX_TRANSLATION_CHARACTERS):
+            batches.append(batch)
+            batch = []
+            characters = 0
+        batch.append(text)
+        characters += len(text)
+    if batch:
+        batches.append(batch)
+
+    for batch in batches:
+        translation_response = client.translate(
+            body=batch, to_language=[target_lang])
+        translated = []
+        for text, translation in zip(batch, translation_response or []):
+            for translated_text in translation.translations:
+                translated.append((text, translated_text.text))
+                translations[text] = translated_text.text
+                break
+        # the whole batch is cached in a single transaction
+        cache.put_many(translated, target_lang)
+
+    # texts the translator didn't return are left untranslated
+    return [translations.get(text, text) for text in texts]
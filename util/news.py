@@ -1,103 +1,32 @@
 """This module defines the news recommendaion system's functions for OpenAI."""
 
-import os.path
-from zipfile import ZipFile
-
 import polars as pl
-import requests
-from azure.ai.translation.text import TextTranslationClient
-from azure.core.credentials import AzureKeyCredential
-from dotenv import load_dotenv
-
-from util.language import translate_text
-
-
-def download_news_articles() -> None:
-    """ Downloads and extracts the news articles dataset. """
-
-    url = "https://mind201910small.blob.core.windows.net/release/MINDsmall_dev.zip"
-    response = requests.get(url, allow_redirects=True, timeout=60)
-
-    with open("data/MINDsmall_dev.zip", 'wb') as file:
-        file.write(response.content)
-
-    with ZipFile("data/MINDsmall_dev.zip", "r") as zip_file:
-        zip_file.extractall("data/MINDsmall_dev")
-
-
-def load_news_articles() -> pl.DataFrame:
-    """ Loads the news articles and returns them in a polars DataFrame.
-
-    Returns:
-        DataFrame: a polars DataFrame with the news articles.
-    """
-
-    if not os.path.isfile("data/MINDsmall_dev/news.tsv"):
-        download_news_articles()
 
-    news_lf = pl.read_csv("data/MINDsmall_dev/news.tsv",
-                       separator="\t",
-                       has_header=False,
-                       schema={"news_id" : pl.datatypes.String,
-                               "category" : pl.datatypes.String,
-                               "subcategory" : pl.datatypes.String,
-                               "title" : pl.datatypes.String,
-                               "abstract" : pl.datatypes.String,
-                               "url" : pl.datatypes.String,
-                               "title_entities" : pl.datatypes.String,
-                               "abstract_entities" : pl.datatypes.String},
-                        ignore_errors=True)
+from util.clients import get_translator_client
+from util.dataset import (  # noqa: F401
+    download_news_articles,
+    load_news_article_engagement,
+    load_news_articles,
+)
+from util.encoding import encode_rows, truncate_abstract
+from util.language import translate_text, translate_texts
+from util.store import get_news_store
+from util.tool_cache import cached_tool
 
-    news_lf = news_lf.with_columns(
-        pl.col("abstract").fill_null("No abstract")
-    )
-    return news_lf
 
-
-def load_news_article_engagement() -> pl.DataFrame:
-    """ Loads the article engagements and returns them in a polars DataFrame.
-
-    Returns:
-        DataFrame: a polars DataFrame with the news article engagements.
-    """
-
-    if not os.path.isfile("data/MINDsmall_dev/behaviors.tsv"):
-        download_news_articles()
-
-    behaviors_lf = pl.read_csv("data/MINDsmall_dev/behaviors.tsv",
-                       separator="\t",
-                       has_header=False,
-                       schema={"impression_id" : pl.datatypes.Int64,
-                               "user_id" : pl.datatypes.String,
-                               "time" : pl.datatypes.String,
-                               "history" : pl.datatypes.String,
-                               "impressions" : pl.datatypes.String,
-                               },
-                        ignore_errors=True)
-
-    return behaviors_lf
-
-
-def get_article_category_by_id(news_lf: pl.DataFrame, id: str) -> str:
+def get_article_category_by_id(id: str) -> str:
     """ Get an article's category by it's news_id.
 
     Args:
-        news_lf (DataFrame): a DataFrame with all the news articles.
         id (str): The article's news_id
 
     Returns:
         str: the article's category
     """
 
-    category = news_lf.filter(
-        pl.col("news_id") == id
-    ).select(
-        pl.col("category")
-    )
-
-    category = category.to_numpy()
-    if len(category) > 0:
-        return category[0][0]
+    article = get_news_store().get_article(id)
+    if article is not None:
+        return article.category
 
 
 def get_articles_with_click_counts() -> pl.DataFrame:
@@ -112,31 +41,30 @@ def get_articles_with_click_counts() -> pl.DataFrame:
         DataFrame: a new DataFrame with news_id, category and click counts.
     """
 
-    news_lf = load_news_articles()
-    behaviors_lf = load_news_article_engagement()
-    # get all engagements in a list
-    all_clicks = behaviors_lf.select(
-        pl.col("impressions")
-    ).rows()
-    # dict to store clicks per news article ID
-    clicks_per_article_id = {}
-    for clicks_group in all_clicks:
-        clicks = clicks_group[0].split(" ")
-        for click in clicks:
-            if click[-1] != "0":
-                article_id = click[:-2]
-                if article_id not in clicks_per_article_id:
-                    category = get_article_category_by_id(news_lf,
-                                                            article_id)
-                    clicks_per_article_id[article_id] = {
-                        "news_id": article_id,
-                        "category": category,
-                        "clicks": int(click[-1])}
-                else:
-                    clicks_per_article_id[
-                        article_id]["clicks"] += int(click[-1])
-
-    return pl.DataFrame(list(clicks_per_article_id.values()))
+    return get_news_store().click_counts
+
+
+def format_titles_and_ids(articles: list[tuple[str, str]], lang: str) -> str:
+    """ Formats the title and ID of news articles as the news functions return
+        them, translating all titles in a single request.
+
+    Args:
+        articles (list[tuple[str, str]]): the news_id and title of each news
+            article.
+        lang (str): the target language to translate the titles.
+
+    Returns:
+        str: the title and ID of each news article.
+    """
+
+    titles = [article[1] for article in articles]
+    if lang != "en" and titles:
+        translator_client = get_translator_client()
+        # IDs are left out of the request so they are never altered
+        titles = translate_texts(translator_client, titles, lang)
+
+    return encode_rows(["title", "id"], [
+        (title, article[0]) for article, title in zip(articles, titles)])
 
 
 RANDOM_NEWS_BY_CATEGORY = {
@@ -192,34 +120,16 @@ def get_random_news_by_category(number: int, category: str, lang: str) -> str:
         str: the title and ID of each news article.
     """
 
-    news_lf = load_news_articles()
-    news_articles = []
+    news_lf = get_news_store().news
 
     news_by_cat = news_lf.filter(
         pl.col("category") == category
     ).select(
-        pl.col("title"),
-        pl.col("news_id")
+        pl.col("news_id"),
+        pl.col("title")
     ).sample(n=number).rows()
 
-    for article in news_by_cat:
-        title_and_id = "Title: \"" + article[0] + "\", \
-ID: \"" + article[1] + "\""
-        if lang != "en":
-            load_dotenv()
-            translator_endpoint = os.getenv('TRANSLATOR_ENDPOINT')
-            translator_region = os.getenv('TRANSLATOR_REGION')
-            translator_key = os.getenv('TRANSLATOR_KEY')
-            credential = AzureKeyCredential(translator_key)
-            translator_client = TextTranslationClient(credential=credential,
-                                                      endpoint=translator_endpoint,
-                                                      region=translator_region)
-            title_and_id = translate_text(translator_client,
-                                          title_and_id,
-                                          lang)
-        news_articles.append(title_and_id)
-
-    return ". ".join(news_articles)
+    return format_titles_and_ids(news_by_cat, lang)
 
 
 MOST_ENGAGED_NEWS_BY_CATEGORY = {
@@ -254,6 +164,12 @@ category to work.",
                         'music'
                     ]
                 },
+                "subcategory": {
+                    "type": "string",
+                    "description": "An optional subcategory of the \
+category, such as 'football_nfl' or 'newsus'. The whole category is used if \
+the category has no such subcategory."
+                },
                 "lang": { "type": "string" }
             },
             "required": ["number", "category", "lang"]
@@ -262,8 +178,10 @@ category to work.",
 }
 
 
+@cached_tool
 def get_most_engaged_news_by_category(number: int, category: str,
-                                      lang: str) -> str:
+                                      lang: str,
+                                      subcategory: str | None = None) -> str:
     """ Retrieves the most engaged news articles by the given category,
         and returns their title.
 
@@ -271,46 +189,73 @@ def get_most_engaged_news_by_category(number: int, category: str,
         number (int): the number of news articles by category to return.
         category (str): the category of news articles to return.
         lang (str): the target language to translate the news.
+        subcategory (str | None): the subcategory of news articles to return,
+            or None for the whole category, which is also used when the
+            category has no such subcategory.
 
     Returns:
         str: the title and ID of each news article.
     """
 
-    news_lf = load_news_articles()
-    top_news_ids = get_articles_with_click_counts()
-    news_articles = []
+    top_news = get_news_store().top_news
+    news_by_cat = top_news.get(category, [])
+    if subcategory is not None:
+        # the subcategory is guessed by OpenAI, so a wrong guess falls back
+        # to the whole category instead of returning nothing
+        news_by_cat = top_news.get((category, subcategory), news_by_cat)
+    news_by_cat = news_by_cat[:int(number)]
 
-    top_news_ids = top_news_ids.filter(
-        pl.col("category") == category
-    ).top_k(number, by="clicks").select(
-        pl.col("news_id")
-    ).to_series()
+    return format_titles_and_ids(news_by_cat, lang)
 
-    news_by_cat = news_lf.filter(
-        pl.col("news_id").is_in(top_news_ids)
-    ).select(
-        pl.col("title"),
-        pl.col("news_id")
-    ).rows()
 
-    for article in news_by_cat:
-        title_and_id = "Title: \"" + article[0] + "\", \
-ID: \"" + article[1] + "\""
-        if lang != "en":
-            load_dotenv()
-            translator_endpoint = os.getenv('TRANSLATOR_ENDPOINT')
-            translator_region = os.getenv('TRANSLATOR_REGION')
-            translator_key = os.getenv('TRANSLATOR_KEY')
-            credential = AzureKeyCredential(translator_key)
-            translator_client = TextTranslationClient(credential=credential,
-                                                      endpoint=translator_endpoint,
-                                                      region=translator_region)
-            title_and_id = translate_text(translator_client,
-                                          title_and_id,
-                                          lang)
-        news_articles.append(title_and_id)
-
-    return ". ".join(news_articles)
+TRENDING_NEWS_BY_CATEGORY = {
+    "type": "function",
+    "function": {
+        "name": "get_trending_news_by_category",
+        "description": "Returns the provided number of trending news article \
+headlines from a given category, or the most engaged ones in the provided \
+number of most recent hours. This function requires at least one category to \
+work.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "number": { "type": "number" },
+                "category": MOST_ENGAGED_NEWS_BY_CATEGORY["function"][
+                    "parameters"]["properties"]["category"],
+                "hours": { "type": "number" },
+                "lang": { "type": "string" }
+            },
+            "required": ["number", "category", "lang"]
+        },
+    },
+}
+
+
+@cached_tool
+def get_trending_news_by_category(number: int, category: str, lang: str,
+                                  hours: float | None = None) -> str:
+    """ Retrieves the trending news articles by the given category, or the
+        most engaged ones in the most recent hours, and returns their title.
+
+    Args:
+        number (int): the number of news articles by category to return.
+        category (str): the category of news articles to return.
+        lang (str): the target language to translate the news.
+        hours (float | None): the number of most recent hours to count the
+            engagements of, or None for the trending news, whose most recent
+            engagements weigh the most.
+
+    Returns:
+        str: the title and ID of each news article.
+    """
+
+    trending = get_news_store().trending
+    if hours is None:
+        news_by_cat = trending.trending(category, int(number))
+    else:
+        news_by_cat = trending.top(category, int(number), float(hours))
+
+    return format_titles_and_ids(news_by_cat, lang)
 
 
 NEWS_ARTICLE_ABSTRACT_BY_TITLE = {
@@ -318,7 +263,9 @@ NEWS_ARTICLE_ABSTRACT_BY_TITLE = {
     "function": {
         "name": "get_article_abstract_by_title",
         "description": "Retrieves the news article's abstract with the provide\
-d title. This function requires at least one title to function correctly.",
+d title, along with the title it matched and a match score from 0 to 1, where \
+1 is an exact match. This function requires at least one title to function \
+correctly.",
         "parameters": {
             "type": "object",
             "properties": {
@@ -331,6 +278,7 @@ d title. This function requires at least one title to function correctly.",
 }
 
 
+@cached_tool
 def get_article_abstract_by_title(title: str, lang: str) -> str:
     """ Retrieves a news article's abstract by the given title.
 
@@ -339,31 +287,30 @@ def get_article_abstract_by_title(title: str, lang: str) -> str:
         lang (str): the target language to translate the news.
 
     Returns:
-        str: the news article's abstract.
+        str: the title matched, its match score and the news article's
+            abstract.
     """
-    news_lf = load_news_articles()
-    abstract = news_lf.filter(
-        pl.col("title") == title
-    ).select(
-        pl.col("abstract")
-    )
-
-    abstract = abstract.to_series().to_list()
-    if len(abstract) > 0:
-        abstract = abstract[0]
+    store = get_news_store()
+    match = store.titles.match(title)
+    if match is None and lang != "en":
+        translator_client = get_translator_client()
+        # the title may have been translated from the English one
+        match = store.titles.match(
+            translate_text(translator_client, title, "en"))
+
+    if match is not None:
+        article = store.get_article(match[0])
+        matched_title = article.title
+        abstract = truncate_abstract(article.abstract)
         if lang != "en":
-            load_dotenv()
-            translator_endpoint = os.getenv('TRANSLATOR_ENDPOINT')
-            translator_region = os.getenv('TRANSLATOR_REGION')
-            translator_key = os.getenv('TRANSLATOR_KEY')
-            credential = AzureKeyCredential(translator_key)
-            translator_client = TextTranslationClient(credential=credential,
-                                                      endpoint=translator_endpoint,
-                                                      region=translator_region)
-            abstract = translate_text(translator_client,
-                                      abstract,
-                                      lang)
-        return abstract
+            translator_client = get_translator_client()
+            # the title and the abstract are translated in a single request
+            matched_title, abstract = translate_texts(
+                translator_client, [matched_title, abstract], lang)
+        # an approximate match may be a different article, so OpenAI is told
+        # how close it was
+        return encode_rows(["title", "score", "abstract"],
+                           [(matched_title, f"{match[1]:.2f}", abstract)])
     else:
         return "Abstract not found."
 
@@ -386,6 +333,7 @@ d id. This function requires at least one news_id to function correctly.",
 }
 
 
+@cached_tool
 def get_article_abstract_by_id(id: str, lang: str) -> str:
     """ Retrieves a news article's abstract by the id.
 
@@ -396,25 +344,11 @@ def get_article_abstract_by_id(id: str, lang: str) -> str:
     Returns:
         str: the news article's abstract.
     """
-    news_lf = load_news_articles()
-    abstract = news_lf.filter(
-        pl.col("news_id") == id
-    ).select(
-        pl.col("abstract")
-    )
-
-    abstract = abstract.to_series().to_list()
-    if len(abstract) > 0:
-        abstract = abstract[0]
+    article = get_news_store().get_article(id)
+    if article is not None:
+        abstract = truncate_abstract(article.abstract)
         if lang != "en":
-            load_dotenv()
-            translator_endpoint = os.getenv('TRANSLATOR_ENDPOINT')
-            translator_region = os.getenv('TRANSLATOR_REGION')
-            translator_key = os.getenv('TRANSLATOR_KEY')
-            credential = AzureKeyCredential(translator_key)
-            translator_client = TextTranslationClient(credential=credential,
-                                                      endpoint=translator_endpoint,
-                                                      region=translator_region)
+            translator_client = get_translator_client()
             abstract = translate_text(translator_client,
                                       abstract,
                                       lang)
@@ -423,5 +357,56 @@ def get_article_abstract_by_id(id: str, lang: str) -> str:
         return "Abstract not found."
 
 
+NEWS_ARTICLE_ABSTRACTS_BY_IDS = {
+    "type": "function",
+    "function": {
+        "name": "get_article_abstracts_by_ids",
+        "description": "Retrieves the abstracts of several news articles with \
+the provided ids at once. Use it instead of several calls to \
+get_article_abstract_by_id.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "ids": {
+                    "type": "array",
+                    "items": { "type": "string" }
+                },
+                "lang": { "type": "string" }
+            },
+            "required": ["ids", "lang"],
+        },
+    },
+}
+
+
+@cached_tool
+def get_article_abstracts_by_ids(ids: list[str], lang: str) -> str:
+    """ Retrieves the abstracts of several news articles by their ids.
+
+    Args:
+        ids (list[str]): the ids of the articles to return.
+        lang (str): the target language to translate the news.
+
+    Returns:
+        str: the ID and abstract of each news article.
+    """
+
+    articles = get_news_store().get_articles(ids)
+    found = [truncate_abstract(article.abstract) for article in articles
+             if article is not None]
+    if lang != "en":
+        translator_client = get_translator_client()
+        # all abstracts are translated in a single request
+        found = translate_texts(translator_client, found, lang)
+
+    abstracts = []
+    found = iter(found)
+    for id, article in zip(ids, articles):
+        abstract = "Abstract not found." if article is None else next(found)
+        abstracts.append((id, abstract))
+
+    return encode_rows(["id", "abstract"], abstracts)
+
+
 if __name__ == "__main__":
     print(get_most_engaged_news_by_category(5, "sports", "en"))
@@ -1,9 +1,28 @@
 """ This module defines the functions to interact with the OpenAI service."""
 
+import asyncio
 import inspect
 import json
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, AzureOpenAI
+from openai.types.chat.chat_completion_message_tool_call import (
+    ChatCompletionMessageToolCall,
+    Function,
+)
+
+from util.encoding import record_tool_tokens
+from util.history import count_tokens
+
+# tool calls suggested in a single response run in parallel, on a pool of
+# their own so a stuck call can't hold up the other conversations
+MAX_TOOL_WORKERS = 8
+TOOL_CALL_TIMEOUT = 30
+# the longest a whole turn of the async conversation may take
+TURN_DEADLINE = 120
 
 
 def check_args(function: callable, args: list) -> bool:
@@ -30,13 +49,168 @@ def check_args(function: callable, args: list) -> bool:
 
     return True
 
+def call_function(function_name: str, arguments: str,
+                  available_functions: dict) -> str:
+    """ Calls one of the available functions with the arguments suggested by
+    OpenAI.
+
+    Args:
+        function_name (str): the name of the function to call.
+        arguments (str): the function's arguments as a JSON object.
+        available_functions (dict): a dictionary with a key for each function.
+
+    Returns:
+        str: the function's response, or the reason it couldn't be called.
+    """
+
+    if function_name not in available_functions:
+        return "Function " + function_name + " does not exist"
+    function_to_call = available_functions[function_name]
+
+    function_args = json.loads(arguments)
+    if check_args(function_to_call, function_args) is False:
+        return "Invalid number of arguments for function: " + function_name
+    return function_to_call(**function_args)
+
+
+def call_tools(tool_calls: list, available_functions: dict,
+               timeout: float = TOOL_CALL_TIMEOUT) -> list[str]:
+    """ Calls all the functions suggested in a response at the same time.
+
+    Args:
+        tool_calls (list): the tool calls suggested by OpenAI.
+        available_functions (dict): a dictionary with a key for each function.
+        timeout (float): the seconds to wait for all the calls to finish.
+
+    Returns:
+        list[str]: the response of each tool call, in the same order.
+    """
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(len(tool_calls), MAX_TOOL_WORKERS)),
+        thread_name_prefix="tool-call")
+    futures = [
+        executor.submit(call_function, tool_call.function.name,
+                        tool_call.function.arguments, available_functions)
+        for tool_call in tool_calls
+    ]
+
+    deadline = time.monotonic() + timeout
+    function_responses = []
+    try:
+        for tool_call, future in zip(tool_calls, futures):
+            try:
+                function_response = future.result(
+                    timeout=max(0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                # a call still waiting for a worker never starts
+                future.cancel()
+                function_response = "Function " + tool_call.function.name + \
+                    " timed out"
+            except Exception as error:
+                function_response = "Function " + tool_call.function.name + \
+                    " failed: " + str(error)
+            record_tool_tokens(tool_call.function.name, function_response)
+            function_responses.append(function_response)
+    finally:
+        # the calls that timed out while running are left to finish on
+        # their own threads
+        executor.shutdown(wait=False, cancel_futures=True)
+    return function_responses
+
+
+def run_tool_calls(messages: list, role: str, content: str | None,
+                   tool_calls: list, available_functions: dict,
+                   verbose: bool = False) -> None:
+    """ Makes the function calls suggested by OpenAI and appends the calls and
+    their responses to the conversation.
+
+    Args:
+        messages (list): the history of the conversation.
+        role (str): the role of the message that suggested the calls.
+        content (str | None): the content of the message that suggested the
+            calls.
+        tool_calls (list): the tool calls suggested by OpenAI.
+        available_functions (dict): a dictionary with a key for each function.
+        verbose (bool): whether to print the calls, their responses and the
+            messages of the next request.
+    """
+
+    if verbose:
+        print("Recommended Function calls:")
+        for tool_call in tool_calls:
+            print(tool_call)
+        print()
+
+    function_responses = call_tools(tool_calls, available_functions)
+
+    if verbose:
+        print("Output of function calls:")
+        for tool_call, function_response in zip(tool_calls,
+                                                 function_responses):
+            print(function_response)
+            print(tool_call.function.name + ":",
+                  count_tokens(function_response), "tokens")
+        print()
+
+    append_tool_messages(messages, role, content, tool_calls,
+                         function_responses)
+
+    if verbose:
+        print("Messages in next request:")
+        for message in messages:
+            print(message)
+        print()
+
+
+def append_tool_messages(messages: list, role: str, content: str | None,
+                         tool_calls: list, function_responses: list) -> None:
+    """ Appends the function calls suggested by OpenAI and their responses to
+    the conversation.
+
+    Args:
+        messages (list): the history of the conversation.
+        role (str): the role of the message that suggested the calls.
+        content (str | None): the content of the message that suggested the
+            calls.
+        tool_calls (list): the tool calls suggested by OpenAI.
+        function_responses (list): the response of each tool call.
+    """
+
+    messages.append({
+        "role": role,
+        "content": content,
+        "tool_calls": [
+            {
+                "id": tool_call.id,
+                "type": "function",
+                "function": {
+                    "name": tool_call.function.name,
+                    "arguments": tool_call.function.arguments,
+                },
+            }
+            for tool_call in tool_calls
+        ],
+    })
+
+    for tool_call, function_response in zip(tool_calls, function_responses):
+        messages.append(
+            {
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "content": function_response,
+            }
+        )
+
+
 def run_multiturn_conversation(client: AzureOpenAI, model_name: str,
                                messages: list, tools: list,
-                               available_functions: json) -> None:
+                               available_functions: json,
+                               verbose: bool = False) -> None:
     """ This function will process the user's prompt, get a response from
-    Azure OpenAI, check if a function call was suggested and if so, make the
-    call and send the function response to OpenAI so it uses the result to
-    reply to the user.
+    Azure OpenAI, check if function calls were suggested and if so, make all
+    the calls in parallel and send the function responses to OpenAI so it
+    uses the results to reply to the user.
 
     Args:
         client (AzureOpenAI): the Azure OpenAI client.
@@ -44,6 +218,7 @@ def run_multiturn_conversation(client: AzureOpenAI, model_name: str,
         messages (list): the history of the conversation.
         tools (list): a list with the functions' definitions.
         available_functions (dict): a dictionary with a key for each function.
+        verbose (bool): whether to print the function calls and messages.
     """
 
     try:
@@ -57,57 +232,222 @@ def run_multiturn_conversation(client: AzureOpenAI, model_name: str,
 
         while response.choices[0].finish_reason == "tool_calls":
             response_message = response.choices[0].message
-            print("Recommended Function call:")
-            print(response_message.tool_calls[0])
-            print()
+            run_tool_calls(messages, response_message.role,
+                           response_message.content,
+                           response_message.tool_calls, available_functions,
+                           verbose)
 
-            function_name = response_message.tool_calls[0].function.name
+            response = client.chat.completions.create(
+                messages=messages,
+                tools=tools,
+                tool_choice="auto",
+                model=model_name,
+                temperature=0,
+            )
 
-            if function_name not in available_functions:
-                return "Function " + function_name + " does not exist"
-            function_to_call = available_functions[function_name]
+    except Exception:
+            response = "content_filter"
 
-            function_args = json.loads(
-                response_message.tool_calls[0].function.arguments)
-            if check_args(function_to_call, function_args) is False:
-                return "Invalid number of arguments for function: " + function_name
-            function_response = function_to_call(**function_args)
+    return response
 
-            print("Output of function call:")
-            print(function_response)
-            print()
 
-            messages.append({
-                "role": response_message.role,
-                "function_call": {
-                    "name": response_message.tool_calls[0].function.name,
-                    "arguments": response_message.tool_calls[0].function.arguments,
-                },
-                "content": None,
-            })
-
-            messages.append(
-                {
-                    "role": "function",
-                    "name": function_name,
-                    "content": function_response,
-                }
-            )
+def stream_multiturn_conversation(client: AzureOpenAI, model_name: str,
+                                  messages: list, tools: list,
+                                  available_functions: dict,
+                                  verbose: bool = False) -> Iterator[str]:
+    """ Streaming version of run_multiturn_conversation. It yields the text
+    of the reply as it is generated, putting the streamed tool calls back
+    together and making them before continuing.
 
-            print("Messages in next request:")
-            for message in messages:
-                print(message)
-            print()
+    Unlike run_multiturn_conversation, errors such as a triggered content
+    filter are raised to the caller, which may have used part of the reply.
 
-            response = client.chat.completions.create(
+    Args:
+        client (AzureOpenAI): the Azure OpenAI client.
+        model_name (str): the OpenAI model name.
+        messages (list): the history of the conversation.
+        tools (list): a list with the functions' definitions.
+        available_functions (dict): a dictionary with a key for each function.
+        verbose (bool): whether to print the function calls and messages.
+
+    Yields:
+        str: the next piece of text of the reply.
+    """
+
+    while True:
+        stream = client.chat.completions.create(
+            messages=messages,
+            tools=tools,
+            tool_choice="auto",
+            model=model_name,
+            temperature=0,
+            stream=True,
+        )
+
+        role = "assistant"
+        content = ""
+        tool_calls = {}
+        finish_reason = None
+        for chunk in stream:
+            # Azure sends the prompt's content filter results in a chunk
+            # without choices
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta
+            role = delta.role or role
+            if delta.content:
+                content += delta.content
+                yield delta.content
+            # a tool call's id and name come in its first delta, and its
+            # arguments are split across the following ones
+            for tool_call_delta in delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(
+                    tool_call_delta.index,
+                    {"id": None, "name": "", "arguments": ""})
+                if tool_call_delta.id:
+                    tool_call["id"] = tool_call_delta.id
+                if tool_call_delta.function is not None:
+                    tool_call["name"] += tool_call_delta.function.name or ""
+                    tool_call["arguments"] += \
+                        tool_call_delta.function.arguments or ""
+            finish_reason = choice.finish_reason or finish_reason
+
+        if finish_reason != "tool_calls":
+            return
+
+        run_tool_calls(messages, role, content or None, [
+            ChatCompletionMessageToolCall(
+                id=tool_call["id"],
+                type="function",
+                function=Function(name=tool_call["name"],
+                                  arguments=tool_call["arguments"]))
+            for _, tool_call in sorted(tool_calls.items())
+        ], available_functions, verbose)
+
+
+async def call_function_async(function_name: str, arguments: str,
+                              available_functions: dict) -> str:
+    """ Calls one of the available functions with the arguments suggested by
+    OpenAI, awaiting it if it is a coroutine function and running it in a
+    thread otherwise.
+
+    Args:
+        function_name (str): the name of the function to call.
+        arguments (str): the function's arguments as a JSON object.
+        available_functions (dict): a dictionary with a key for each function.
+
+    Returns:
+        str: the function's response, or the reason it couldn't be called.
+    """
+
+    function_to_call = available_functions.get(function_name)
+    if inspect.iscoroutinefunction(function_to_call):
+        function_args = json.loads(arguments)
+        if check_args(function_to_call, function_args) is False:
+            return "Invalid number of arguments for function: " + \
+                function_name
+        return await function_to_call(**function_args)
+
+    # the news tools and their Azure AI Translator requests are blocking, so
+    # each call takes a thread of the event loop's default executor, whose
+    # size bounds how many of them run at once
+    return await asyncio.to_thread(call_function, function_name, arguments,
+                                   available_functions)
+
+
+async def call_tools_async(tool_calls: list, available_functions: dict,
+                           timeout: float = TOOL_CALL_TIMEOUT) -> list[str]:
+    """ Async version of call_tools, calling all the functions suggested in a
+    response at the same time.
+
+    Args:
+        tool_calls (list): the tool calls suggested by OpenAI.
+        available_functions (dict): a dictionary with a key for each function.
+        timeout (float): the seconds to wait for each call to finish.
+
+    Returns:
+        list[str]: the response of each tool call, in the same order.
+    """
+
+    async def call_tool(tool_call) -> str:
+        try:
+            function_response = await asyncio.wait_for(
+                call_function_async(tool_call.function.name,
+                                    tool_call.function.arguments,
+                                    available_functions), timeout)
+        except asyncio.TimeoutError:
+            function_response = "Function " + tool_call.function.name + \
+                " timed out"
+        except Exception as error:
+            function_response = "Function " + tool_call.function.name + \
+                " failed: " + str(error)
+        record_tool_tokens(tool_call.function.name, function_response)
+        return function_response
+
+    return list(await asyncio.gather(
+        *(call_tool(tool_call) for tool_call in tool_calls)))
+
+
+async def run_multiturn_conversation_async(
+        client: AsyncAzureOpenAI, model_name: str, messages: list,
+        tools: list, available_functions: dict,
+        deadline: float = TURN_DEADLINE) -> object:
+    """ Async version of run_multiturn_conversation, for callers that already
+    run an event loop. The requests to OpenAI don't hold a thread while they
+    wait, but the tools still do: the news functions and their translations
+    are synchronous, so they run in the event loop's default executor and
+    the number of tool calls in flight is bounded by its threads. Neither
+    app.py nor streamlit.py uses it, as both run one conversation per thread.
+
+    Cancelling the task running it cancels the pending requests and tool
+    calls that haven't started.
+
+    Args:
+        client (AsyncAzureOpenAI): the async Azure OpenAI client.
+        model_name (str): the OpenAI model name.
+        messages (list): the history of the conversation.
+        tools (list): a list with the functions' definitions.
+        available_functions (dict): a dictionary with a key for each function,
+            either a function or a coroutine function.
+        deadline (float): the seconds the whole turn may take.
+
+    Returns:
+        the final OpenAI response, "content_filter" if the request failed, or
+            a message if the turn took longer than the deadline.
+    """
+
+    async def run_turn():
+        response = await client.chat.completions.create(
+            messages=messages,
+            tools=tools,
+            tool_choice="auto",
+            model=model_name,
+            temperature=0,
+        )
+
+        while response.choices[0].finish_reason == "tool_calls":
+            response_message = response.choices[0].message
+            tool_calls = response_message.tool_calls
+            function_responses = await call_tools_async(tool_calls,
+                                                        available_functions)
+            append_tool_messages(messages, response_message.role,
+                                 response_message.content, tool_calls,
+                                 function_responses)
+
+            response = await client.chat.completions.create(
                 messages=messages,
                 tools=tools,
                 tool_choice="auto",
                 model=model_name,
                 temperature=0,
             )
+        return response
 
+    try:
+        return await asyncio.wait_for(run_turn(), deadline)
+    except asyncio.TimeoutError:
+        return "The conversation turn took longer than " + str(deadline) + \
+            " seconds"
     except Exception:
-            response = "content_filter"
-
-    return response
+        return "content_filter"
@@ -2,12 +2,7 @@
 triggers content filtering.
 """
 
-import os
-
-from azure.ai.translation.text import TextTranslationClient
-from azure.core.credentials import AzureKeyCredential
-from dotenv import load_dotenv
-
+from util.clients import get_translator_client
 from util.language import translate_text
 
 CONTENT_FILTERING_MSG = "I'm sorry, but I'm not able to answer your request \
@@ -27,14 +22,7 @@ def get_content_filtering_message(lang: str) -> str:
     """
 
     if lang != "en-US":
-        load_dotenv()
-        translator_endpoint = os.getenv('TRANSLATOR_ENDPOINT')
-        translator_region = os.getenv('TRANSLATOR_REGION')
-        translator_key = os.getenv('TRANSLATOR_KEY')
-        credential = AzureKeyCredential(translator_key)
-        translator_client = TextTranslationClient(credential=credential,
-                                                    endpoint=translator_endpoint,
-                                                    region=translator_region)
+        translator_client = get_translator_client()
         content_filtering_msg = translate_text(translator_client,
                                     CONTENT_FILTERING_MSG,
                                     lang)
@@ -0,0 +1,253 @@
+""" This module recognizes the most common, formulaic requests, such as "give
+me the top 3 finance news", and calls the news function for them directly,
+so Azure OpenAI only has to phrase the answer.
+"""
+
+import json
+import os
+import threading
+import uuid
+
+from dotenv import load_dotenv
+from openai.types.chat.chat_completion_message_tool_call import (
+    ChatCompletionMessageToolCall,
+    Function,
+)
+
+from util.index import normalize_title
+from util.news import MOST_ENGAGED_NEWS_BY_CATEGORY
+from util.openai import append_tool_messages
+
+CATEGORIES = MOST_ENGAGED_NEWS_BY_CATEGORY["function"]["parameters"][
+    "properties"]["category"]["enum"]
+
+# words, in English and Spanish, naming each category
+CATEGORY_WORDS = {
+    **{category: category for category in CATEGORIES},
+    "sport": "sports", "deportes": "sports", "deporte": "sports",
+    "viajes": "travel", "salud": "health", "noticias": "news",
+    "movie": "movies", "film": "movies", "films": "movies",
+    "peliculas": "movies", "cine": "movies", "television": "tv",
+    "entretenimiento": "entertainment", "videos": "video",
+    "business": "finance", "financial": "finance",
+    "finanzas": "finance", "negocios": "finance", "economia": "finance",
+    "ninos": "kids", "clima": "weather",
+    "car": "autos", "cars": "autos", "carros": "autos", "coches": "autos",
+    "food": "foodanddrink", "comida": "foodanddrink",
+    "cocina": "foodanddrink", "musica": "music",
+}
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "uno": 1, "dos": 2,
+    "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6, "siete": 7, "ocho": 8,
+    "nueve": 9, "diez": 10,
+}
+
+# phrases asking for the most engaged news
+ENGAGED_PHRASES = [
+    "top", "most popular", "most read", "most engaged", "most clicked",
+    "best", "principales", "mas populares", "mas leidas", "mas leidos",
+    "mejores", "mas vistas",
+]
+
+# words asking for something the router doesn't handle
+OTHER_WORDS = {
+    "abstract", "summary", "summarize", "about", "why", "how", "random",
+    "resumen", "resume", "sobre", "por", "como", "aleatorias", "and", "y",
+    # recent news are for get_trending_news_by_category
+    "trending", "trend", "recent", "recently", "latest", "last", "past",
+    "today", "now", "hour", "hours", "tendencia", "tendencias", "reciente",
+    "recientes", "ultimas", "ultimos", "ultima", "ultimo", "hoy", "ahora",
+    "hora", "horas",
+}
+
+# words naming what is asked for, one of them must be in the request
+NEWS_WORDS = {
+    "news", "headlines", "articles", "stories", "noticias", "titulares",
+}
+
+# time units, a number followed by one is a time span and not how many news
+TIME_WORDS = {
+    "minute", "minutes", "hour", "hours", "day", "days", "week", "weeks",
+    "minuto", "minutos", "hora", "horas", "dia", "dias", "semana", "semanas",
+}
+
+SPANISH_WORDS = {"noticias", "dame", "las", "los", "principales", "mejores",
+                 "mas", "de", "quiero"}
+
+MAX_ROUTED_WORDS = 16
+MAX_ROUTED_NUMBER = 10
+DEFAULT_ROUTED_NUMBER = 5
+
+
+class IntentRouter:
+    """ Recognizes requests for the most engaged news of a category with
+    simple rules, and only when there is no doubt about what is asked.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def route(self, text: str, lang: str | None = None) -> dict | None:
+        """ Recognizes a request for the most engaged news of a category.
+
+        Args:
+            text (str): the user's request.
+            lang (str | None): the request's language, e.g. "es-MX", or None
+                to guess it from the request.
+
+        Returns:
+            dict | None: the arguments of get_most_engaged_news_by_category,
+                or None if the request isn't clearly one for it.
+
+        Examples:
+            >>> router = IntentRouter()
+            >>> router.route("Give me the top 3 finance news", "en-US")
+            {'number': 3, 'category': 'finance', 'lang': 'en'}
+            >>> router.route("Dame los titulares de deportes mas leidos")
+            {'number': 5, 'category': 'sports', 'lang': 'es'}
+            >>> router.route("What's the best car to buy?") is None
+            True
+            >>> router.route("What is the best food in Mexico?") is None
+            True
+            >>> router.route("Who is the best music artist?") is None
+            True
+            >>> router.route("top 10 movies of all time") is None
+            True
+            >>> router.route(
+            ...     "What are the top sports news from the last 2 hours?"
+            ... ) is None
+            True
+            >>> router.route("Top sports news today") is None
+            True
+            >>> router.route("Las principales noticias de hoy") is None
+            True
+        """
+
+        normalized = " " + normalize_title(text) + " "
+        words = normalized.split()
+        # a request that doesn't name news may be about anything else
+        if not NEWS_WORDS.intersection(words):
+            return None
+        # "the last 2 hours" is a time span, which the router doesn't handle
+        if any((word.isdigit() or word in NUMBER_WORDS) and
+               next_word in TIME_WORDS
+               for word, next_word in zip(words, words[1:])):
+            return None
+        categories = {CATEGORY_WORDS[word] for word in words
+                      if word in CATEGORY_WORDS}
+        # "news" is also how most requests name what they ask for
+        if len(categories) > 1:
+            categories.discard("news")
+        numbers = [int(word) if word.isdigit() else NUMBER_WORDS[word]
+                   for word in words
+                   if word.isdigit() or word in NUMBER_WORDS]
+
+        if (len(words) > MAX_ROUTED_WORDS or len(categories) != 1 or
+                len(numbers) > 1 or OTHER_WORDS.intersection(words) or
+                not any(" " + phrase + " " in normalized
+                        for phrase in ENGAGED_PHRASES)):
+            return None
+        number = numbers[0] if numbers else DEFAULT_ROUTED_NUMBER
+        if not 0 < number <= MAX_ROUTED_NUMBER:
+            return None
+
+        if lang:
+            lang = lang.split("-")[0]
+        else:
+            lang = "es" if SPANISH_WORDS.intersection(words) else "en"
+        return {"number": number, "category": categories.pop(),
+                "lang": lang}
+
+    def inject(self, messages: list, lang: str | None,
+               available_functions: dict) -> bool:
+        """ Routes the last user message and, if it is recognized, calls the
+        news function and appends the call and its result to the
+        conversation, as if OpenAI had suggested it.
+
+        Args:
+            messages (list): the history of the conversation.
+            lang (str | None): the request's language, e.g. "es-MX", or None
+                to guess it from the request.
+            available_functions (dict): a dictionary with a key for each
+                function.
+
+        Returns:
+            bool: True if the request was routed, otherwise False, also when
+                the news function failed and OpenAI should handle it.
+        """
+
+        name = MOST_ENGAGED_NEWS_BY_CATEGORY["function"]["name"]
+        response = None
+        if self.enabled and name in available_functions and messages and \
+                messages[-1]["role"] == "user" and messages[-1]["content"]:
+            arguments = self.route(messages[-1]["content"], lang)
+            if arguments is not None:
+                try:
+                    response = available_functions[name](**arguments)
+                except Exception as error:
+                    print("Could not route the request:", error)
+
+        with self._lock:
+            if response is None:
+                self.misses += 1
+                return False
+            self.hits += 1
+
+        tool_call = ChatCompletionMessageToolCall(
+            id="call_" + uuid.uuid4().hex,
+            type="function",
+            function=Function(name=name, arguments=json.dumps(arguments)))
+        append_tool_messages(messages, "assistant", None, [tool_call],
+                             [response])
+        return True
+
+    def stats(self) -> dict:
+        """ Returns how many requests were routed.
+
+        Returns:
+            dict: the number of hits and misses, and the hit rate.
+        """
+
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / total if total else 0.0}
+
+    def summary(self) -> str:
+        """ Describes how many requests were routed, for the apps to show.
+
+        Returns:
+            str: the number of requests routed out of all, and the hit rate.
+        """
+
+        stats = self.stats()
+        total = stats["hits"] + stats["misses"]
+        return (f"{stats['hits']} of {total} requests routed locally "
+                f"({stats['hit_rate']:.0%})")
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_intent_router() -> IntentRouter:
+    """ Returns the process-wide intent router, creating it on first use. It
+    can be turned off with INTENT_ROUTER=0.
+
+    Returns:
+        IntentRouter: the shared intent router.
+    """
+
+    global _router
+    with _router_lock:
+        if _router is None:
+            load_dotenv()
+            _router = IntentRouter(
+                enabled=os.getenv("INTENT_ROUTER", "1") != "0")
+        return _router
@@ -1,11 +1,97 @@
 """ This module defines the functions for text-to-speech and speech-to-text."""
 
+import io
+import queue
+import re
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+
 import azure.cognitiveservices.speech as speech_sdk
 from azure.cognitiveservices.speech import SpeechConfig
 
+from util.audio_cache import get_audio_cache
+from util.clients import get_speech_config
+
 PROPERTIES = speech_sdk.PropertyId
 ADSLR = PROPERTIES.SpeechServiceConnection_AutoDetectSourceLanguageResult
 
+# a sentence ends with a punctuation mark, and optional closing quotes or
+# brackets, followed by whitespace
+SENTENCE_END = re.compile(r"[.!?…]+[\"')\]]*\s+|\n+")
+# a period after an initial or a title doesn't end the sentence
+ABBREVIATION = re.compile(r"(?:\b[A-Za-z]|Mr|Mrs|Ms|Dr|Sr|Jr|St|vs)\.$")
+# shorter sentences are joined with the next one, to avoid choppy speech
+MIN_SENTENCE_LENGTH = 20
+
+# the voice that speaks each language
+VOICES = {
+    "es-MX": "es-MX-CarlotaNeural",
+    "en-US": "en-US-AvaMultilingualNeural",
+}
+DEFAULT_VOICE = VOICES["en-US"]
+# the languages the speech is recognized in
+RECOGNITION_LANGUAGES = ["en-US", "es-MX", "fr-FR", "pt-BR"]
+# the format of the PCM recordings transcribed by speech_to_text_streamlit
+RECORDING_SAMPLE_RATE = 16000
+RECORDING_SAMPLE_WIDTH = 2
+# the synthesizers kept connected per voice when several sessions speak at
+# the same time, e.g. in Streamlit
+SYNTHESIZERS_PER_VOICE = 4
+
+_voice_lock = threading.Lock()
+
+
+def audio_format(speech_config: SpeechConfig) -> str:
+    """ Returns the name of the audio format synthesized with a speech
+    configuration, for the audio cache key.
+
+    Args:
+        speech_config (SpeechConfig): the speech client credentials.
+
+    Returns:
+        str: the output format, or "default" if it isn't set.
+    """
+
+    return speech_config.speech_synthesis_output_format_string or "default"
+
+
+def play_audio(audio: bytes) -> None:
+    """ Plays synthesized WAV audio on the default speaker.
+
+    Args:
+        audio (bytes): the audio, with its RIFF header.
+    """
+
+    # pydub warns about ffmpeg on import, which WAV playback doesn't need
+    from pydub import AudioSegment
+    from pydub.playback import play
+
+    play(AudioSegment.from_file(io.BytesIO(audio), format="wav"))
+
+def create_synthesizer(speech_config: SpeechConfig, voice: str,
+                       speaker: bool = True) -> speech_sdk.SpeechSynthesizer:
+    """ Creates a synthesizer that speaks with the given voice.
+
+    Args:
+        speech_config (SpeechConfig): the speech client credentials.
+        voice (str): the name of the voice.
+        speaker (bool): whether the audio is played on the default speaker,
+            otherwise it is only returned in the result.
+
+    Returns:
+        SpeechSynthesizer: the synthesizer.
+    """
+
+    # every thread shares the configuration and the synthesizer copies it
+    # when created, so the voice is only ever set under this lock
+    with _voice_lock:
+        speech_config.speech_synthesis_voice_name = voice
+        if speaker:
+            return speech_sdk.SpeechSynthesizer(speech_config)
+        return speech_sdk.SpeechSynthesizer(speech_config, audio_config=None)
+
+
 def text_to_speech(speech_config: SpeechConfig, text: str, lang: str) -> None:
     """ Synthetizes the provided text as sound.
 
@@ -15,46 +101,51 @@ def text_to_speech(speech_config: SpeechConfig, text: str, lang: str) -> None:
         lang (str): the language of the text
     """
 
-    match lang:
-        case "es-MX":
-            speech_config.speech_synthesis_voice_name = "es-MX-CarlotaNeural"
-        case "en-US":
-            speech_config.speech_synthesis_voice_name = "en-US-AvaMultilingu\
-alNeural"
+    voice = VOICES.get(lang, DEFAULT_VOICE)
+    cache = get_audio_cache()
+    audio = cache.get(text, voice, audio_format(speech_config))
+    if audio is not None:
+        play_audio(audio)
+        return
 
-    speech_synthesizer = speech_sdk.SpeechSynthesizer(speech_config)
+    speech_synthesizer = create_synthesizer(speech_config, voice)
 
     speak = speech_synthesizer.speak_text_async(text).get()
     if speak.reason != speech_sdk.ResultReason.SynthesizingAudioCompleted:
         print(speak.reason)
+    else:
+        cache.put(text, voice, audio_format(speech_config), speak.audio_data)
 
 
 def text_to_speech_streamlit(speech_config: SpeechConfig,
-                             text: str, lang: str) -> None:
-    """ Synthetizes the provided text as sound and saves it to an audio file
-        for Streamlit to reproduce.
+                             text: str, lang: str) -> bytes:
+    """ Synthetizes the provided text as sound in memory for Streamlit to
+        reproduce.
 
     Args:
         speech_config (SpeechConfig): the speech client credentials
         text (str): the text to speak
         lang (str): the language of the text
+
+    Returns:
+        bytes: the WAV audio, empty if it couldn't be synthesized.
     """
 
-    match lang:
-        case "es-MX":
-            speech_config.speech_synthesis_voice_name = "es-MX-CarlotaNeural"
-        case "en-US":
-            speech_config.speech_synthesis_voice_name = "en-US-AvaMultilingu\
-alNeural"
+    voice = VOICES.get(lang, DEFAULT_VOICE)
+    cache = get_audio_cache()
+    audio = cache.get(text, voice, audio_format(speech_config))
+    if audio is not None:
+        return audio
 
-    audio_config = speech_sdk.audio.AudioOutputConfig(
-        filename="sounds/response.wav")
-    speech_synthesizer = speech_sdk.SpeechSynthesizer(
-        speech_config, audio_config)
+    speech_synthesizer = create_synthesizer(speech_config, voice,
+                                            speaker=False)
 
     speak = speech_synthesizer.speak_text_async(text).get()
     if speak.reason != speech_sdk.ResultReason.SynthesizingAudioCompleted:
         print(speak.reason)
+        return b""
+    cache.put(text, voice, audio_format(speech_config), speak.audio_data)
+    return speak.audio_data
 
 
 def speech_to_text(speech_config: SpeechConfig) -> tuple[str, str]:
@@ -95,11 +186,13 @@ def speech_to_text(speech_config: SpeechConfig) -> tuple[str, str]:
     return text, language
 
 
-def speech_to_text_streamlit(speech_config: SpeechConfig) -> tuple[str, str]:
-    """ Transcribes the sound from an audio file into text.
+def speech_to_text_streamlit(speech_config: SpeechConfig,
+                             pcm: bytes) -> tuple[str, str]:
+    """ Transcribes recorded sound into text.
 
     Args:
         speech_config (SpeechConfig): the speech client credentials.
+        pcm (bytes): the recorded sound, as 16 kHz, 16-bit mono PCM.
 
     Returns:
         tuple[str, str]: a tuple with the text and language detected.
@@ -111,7 +204,14 @@ def speech_to_text_streamlit(speech_config: SpeechConfig) -> tuple[str, str]:
                                                 languages=["en-US", "es-MX",
                                                            "fr-FR", "pt-BR"])
 
-    audio_config = speech_sdk.AudioConfig(filename='sounds/prompt.wav')
+    stream = speech_sdk.audio.PushAudioInputStream(
+        speech_sdk.audio.AudioStreamFormat(
+            samples_per_second=RECORDING_SAMPLE_RATE,
+            bits_per_sample=RECORDING_SAMPLE_WIDTH * 8,
+            channels=1))
+    stream.write(pcm)
+    stream.close()
+    audio_config = speech_sdk.AudioConfig(stream=stream)
     speech_recognizer = speech_sdk.SpeechRecognizer(
         speech_config, audio_config,
         auto_detect_source_language_config=language_config)
@@ -128,3 +228,354 @@ def speech_to_text_streamlit(speech_config: SpeechConfig) -> tuple[str, str]:
             print(cancellation.error_details)
 
     return text, language
+
+
+def split_sentences(chunks: Iterable[str]) -> Iterator[str]:
+    """ Groups streamed pieces of text into whole sentences as soon as each
+    sentence is complete.
+
+    Args:
+        chunks (Iterable[str]): the pieces of text, e.g. streamed tokens.
+
+    Yields:
+        str: the next complete sentence, and finally whatever text is left.
+    """
+
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        for end in SENTENCE_END.finditer(buffer):
+            if ABBREVIATION.search(buffer, start, end.start() + 1):
+                continue
+            if end.end() - start >= MIN_SENTENCE_LENGTH:
+                yield buffer[start:end.end()].strip()
+                start = end.end()
+        buffer = buffer[start:]
+    if buffer.strip():
+        yield buffer.strip()
+
+
+class SentenceSpeaker:
+    """ Speaks sentences in order on a background thread, so the next
+    sentences can be generated while the previous ones are being spoken.
+    """
+
+    def __init__(self, session: "SpeechSession", lang: str):
+        self._session = session
+        self._lang = lang
+        self._sentences = queue.Queue()
+        self._thread = threading.Thread(target=self._speak_sentences,
+                                        daemon=True)
+        self._thread.start()
+
+    def _speak_sentences(self) -> None:
+        while (sentence := self._sentences.get()) is not None:
+            self._session.speak(sentence, self._lang)
+
+    def speak(self, sentence: str) -> None:
+        """ Queues a sentence to be spoken after the previous ones.
+
+        Args:
+            sentence (str): the sentence to speak.
+        """
+
+        self._sentences.put(sentence)
+
+    def close(self) -> None:
+        """ Waits until all the queued sentences have been spoken. """
+
+        self._sentences.put(None)
+        self._thread.join()
+
+
+def read_speech(speech: speech_sdk.SpeechRecognitionResult) -> tuple[str, str]:
+    """ Reads the text and language of a recognition result, printing why
+    nothing was recognized otherwise.
+
+    Args:
+        speech (SpeechRecognitionResult): the recognition result.
+
+    Returns:
+        tuple[str, str]: a tuple with the text and language detected, empty
+            if nothing was recognized.
+    """
+
+    if speech.reason == speech_sdk.ResultReason.RecognizedSpeech:
+        return speech.text, speech.properties[ADSLR]
+    print(speech.reason)
+    if speech.reason == speech_sdk.ResultReason.Canceled:
+        cancellation = speech.cancellation_details
+        print(cancellation.reason)
+        print(cancellation.error_details)
+    return '', ''
+
+
+class SpeechSession:
+    """ Keeps the Azure AI Speech synthesizers and recognizers alive between
+    turns, with their connections opened in advance, so each turn doesn't
+    pay for setting them up again.
+
+    There is a pool of up to `pool_size` synthesizers per voice, so that
+    many texts can be synthesized at the same time, and one recognizer per
+    microphone. Without a speaker, the synthesizers only return the audio,
+    e.g. for Streamlit to play it in the browser.
+    The recognizer can either recognize one utterance at a time, or run in
+    continuous mode, where it keeps listening and queues every utterance.
+    """
+
+    def __init__(self, speech_config: SpeechConfig, speaker: bool = True,
+                 pool_size: int = 1):
+        self._speech_config = speech_config
+        self._speaker = speaker
+        self._pool_size = pool_size
+        self._lock = threading.Lock()
+        self._synthesizers = {}
+        self._synthesizer_counts = {}
+        self._recognizers = {}
+        self._connections = []
+        self._continuous = None
+        self._utterances = queue.Queue()
+
+    def _new_synthesizer(self, voice: str) -> speech_sdk.SpeechSynthesizer:
+        synthesizer = create_synthesizer(self._speech_config, voice,
+                                         self._speaker)
+        self._open(speech_sdk.Connection.from_speech_synthesizer(synthesizer),
+                   False)
+        return synthesizer
+
+    def _take_synthesizer(self, voice: str) -> speech_sdk.SpeechSynthesizer:
+        with self._lock:
+            idle = self._synthesizers.setdefault(voice, queue.Queue())
+            count = self._synthesizer_counts.get(voice, 0)
+            create = idle.empty() and count < self._pool_size
+            if create:
+                self._synthesizer_counts[voice] = count + 1
+        if create:
+            try:
+                return self._new_synthesizer(voice)
+            except Exception:
+                with self._lock:
+                    self._synthesizer_counts[voice] -= 1
+                raise
+        # waits for another text of the same voice when the pool is full
+        return idle.get()
+
+    def open_synthesizers(self, lang: str, count: int = 1) -> None:
+        """ Creates synthesizers for the language's voice and opens their
+        connections, up to the pool size, so the first texts don't wait for
+        them.
+
+        Args:
+            lang (str): the language to speak, e.g. "es-MX".
+            count (int): the number of synthesizers to have ready.
+        """
+
+        voice = VOICES.get(lang, DEFAULT_VOICE)
+        with self._lock:
+            idle = self._synthesizers.setdefault(voice, queue.Queue())
+            existing = self._synthesizer_counts.get(voice, 0)
+            added = max(0, min(count, self._pool_size) - existing)
+            self._synthesizer_counts[voice] = existing + added
+        for _ in range(added):
+            idle.put(self._new_synthesizer(voice))
+
+    @contextmanager
+    def synthesizer(self, lang: str) -> Iterator[speech_sdk.SpeechSynthesizer]:
+        """ Takes a synthesizer of the language's voice from the pool for the
+        duration of a with block, creating it and opening its connection if
+        none is idle and the pool isn't full.
+
+        Args:
+            lang (str): the language to speak, e.g. "es-MX".
+
+        Yields:
+            SpeechSynthesizer: the synthesizer, returned to the pool after.
+        """
+
+        voice = VOICES.get(lang, DEFAULT_VOICE)
+        synthesizer = self._take_synthesizer(voice)
+        try:
+            yield synthesizer
+        finally:
+            self._synthesizers[voice].put(synthesizer)
+
+    def recognizer(self, device_name: str | None = None,
+                   continuous: bool = False) -> speech_sdk.SpeechRecognizer:
+        """ Returns the recognizer of a microphone, creating it and opening
+        its connection on first use.
+
+        Args:
+            device_name (str | None): the microphone's device name, or None
+                for the default microphone.
+            continuous (bool): whether the connection is opened for
+                continuous recognition.
+
+        Returns:
+            SpeechRecognizer: the recognizer.
+        """
+
+        with self._lock:
+            if device_name not in self._recognizers:
+                language_config = speech_sdk.languageconfig.\
+                    AutoDetectSourceLanguageConfig(
+                        languages=RECOGNITION_LANGUAGES)
+                if device_name is None:
+                    audio_config = speech_sdk.AudioConfig(
+                        use_default_microphone=True)
+                else:
+                    audio_config = speech_sdk.AudioConfig(
+                        device_name=device_name)
+                recognizer = speech_sdk.SpeechRecognizer(
+                    self._speech_config, audio_config,
+                    auto_detect_source_language_config=language_config)
+                self._open(speech_sdk.Connection.from_recognizer(recognizer),
+                           continuous)
+                self._recognizers[device_name] = recognizer
+            return self._recognizers[device_name]
+
+    def _open(self, connection: speech_sdk.Connection,
+              continuous: bool) -> None:
+        try:
+            connection.open(continuous)
+            # the connection is closed when it is garbage collected
+            self._connections.append(connection)
+        except RuntimeError as error:
+            print("Could not open the speech connection:", error)
+
+    def speak(self, text: str, lang: str) -> None:
+        """ Synthetizes the provided text as sound, or plays it from the audio
+        cache if it was synthesized before.
+
+        Args:
+            text (str): the text to speak.
+            lang (str): the language of the text.
+        """
+
+        voice = VOICES.get(lang, DEFAULT_VOICE)
+        audio = get_audio_cache().get(text, voice,
+                                      audio_format(self._speech_config))
+        if audio is not None:
+            play_audio(audio)
+            return
+        self._synthesize(text, lang, voice)
+
+    def synthesize(self, text: str, lang: str) -> bytes:
+        """ Synthetizes the provided text as audio, or takes it from the
+        audio cache if it was synthesized before.
+
+        Args:
+            text (str): the text to speak.
+            lang (str): the language of the text.
+
+        Returns:
+            bytes: the WAV audio, empty if it couldn't be synthesized.
+        """
+
+        voice = VOICES.get(lang, DEFAULT_VOICE)
+        audio = get_audio_cache().get(text, voice,
+                                      audio_format(self._speech_config))
+        if audio is not None:
+            return audio
+        return self._synthesize(text, lang, voice)
+
+    def _synthesize(self, text: str, lang: str, voice: str) -> bytes:
+        with self.synthesizer(lang) as synthesizer:
+            speak = synthesizer.speak_text_async(text).get()
+        if speak.reason != speech_sdk.ResultReason.SynthesizingAudioCompleted:
+            print(speak.reason)
+            return b""
+        get_audio_cache().put(text, voice, audio_format(self._speech_config),
+                              speak.audio_data)
+        return speak.audio_data
+
+    def recognize_once(self, device_name: str | None = None) -> tuple[str,
+                                                                       str]:
+        """ Transcribes one utterance from the microphone into text.
+
+        Args:
+            device_name (str | None): the microphone's device name, or None
+                for the default microphone.
+
+        Returns:
+            tuple[str, str]: a tuple with the text and language detected.
+        """
+
+        print("Speak now...")
+        speech = self.recognizer(device_name).recognize_once_async().get()
+        text, language = read_speech(speech)
+        if text:
+            print("Text:", text)
+            print("Language:", language)
+        return text, language
+
+    def start_continuous(self, device_name: str | None = None) -> None:
+        """ Starts listening to the microphone continuously, queueing every
+        utterance for listen().
+
+        Args:
+            device_name (str | None): the microphone's device name, or None
+                for the default microphone.
+        """
+
+        recognizer = self.recognizer(device_name, continuous=True)
+        with self._lock:
+            if self._continuous is not None:
+                return
+            self._continuous = recognizer
+
+        def recognized(event):
+            text, language = read_speech(event.result)
+            if text:
+                self._utterances.put((text, language))
+
+        recognizer.recognized.connect(recognized)
+        recognizer.start_continuous_recognition_async().get()
+
+    def listen(self, discard_pending: bool = True) -> tuple[str, str]:
+        """ Waits for the next utterance in continuous mode.
+
+        Args:
+            discard_pending (bool): whether to discard the utterances
+                recognized before the call, e.g. while the reply was being
+                spoken.
+
+        Returns:
+            tuple[str, str]: a tuple with the text and language detected.
+        """
+
+        if discard_pending:
+            while not self._utterances.empty():
+                self._utterances.get_nowait()
+        print("Speak now...")
+        text, language = self._utterances.get()
+        print("Text:", text)
+        print("Language:", language)
+        return text, language
+
+    def stop_continuous(self) -> None:
+        """ Stops listening to the microphone continuously. """
+
+        with self._lock:
+            recognizer, self._continuous = self._continuous, None
+        if recognizer is not None:
+            recognizer.stop_continuous_recognition_async().get()
+            recognizer.recognized.disconnect_all()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_speech_session() -> SpeechSession:
+    """ Returns the process-wide speech session, creating it on first use.
+
+    Returns:
+        SpeechSession: the shared speech session.
+    """
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = SpeechSession(get_speech_config())
+        return _session
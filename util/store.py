@@ -0,0 +1,257 @@
+""" This module keeps a single, process-wide copy of the news dataset in
+memory so the news functions don't parse the TSV files on every call.
+"""
+
+import os
+import threading
+from collections.abc import Callable
+from typing import Any
+
+import polars as pl
+
+from util.dataset import (
+    BEHAVIORS_PATH,
+    DATASET_BACKEND,
+    NEWS_PATH,
+    compact_news_articles,
+    download_news_articles,
+    load_news_articles,
+    scan_news_articles,
+)
+from util.engagement import EngagementTable
+from util.index import (
+    Article,
+    TitleIndex,
+    TrendingIndex,
+    build_article_index,
+    build_top_news_index,
+)
+
+
+def file_signature(path: str) -> tuple[int, int] | None:
+    """ Returns the modification time and size of a file.
+
+    Args:
+        path (str): the path of the file.
+
+    Returns:
+        tuple[int, int] | None: the file's mtime in ns and size in bytes, or
+            None if the file does not exist.
+    """
+
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class NewsStore:
+    """ Owns the parsed news articles, engagements and any tables derived
+    from them, and reloads them only when the files on disk change.
+
+    All methods are thread-safe. Every reload of the news articles or the
+    engagement table bumps `version`, and drops the derived tables so they
+    are rebuilt from the new data on next use.
+    """
+
+    def __init__(self, news_path: str = NEWS_PATH,
+                 behaviors_path: str = BEHAVIORS_PATH):
+        self.news_path = news_path
+        self.behaviors_path = behaviors_path
+        self.version = 0
+        self._lock = threading.RLock()
+        self._news = None
+        self._news_signature = None
+        self._engagement = None
+        self._engagement_signature = None
+        self._derived = {}
+
+    def _refresh_news(self) -> bool:
+        signature = file_signature(self.news_path)
+        if self._news is not None and signature == self._news_signature:
+            return False
+        # a compact copy private to this process, instead of the frame read
+        # from the Arrow IPC cache, see compact_news_articles
+        if DATASET_BACKEND == "lazy":
+            # only the columns the news functions read are loaded
+            self._news = compact_news_articles(
+                scan_news_articles(self.news_path))
+        else:
+            self._news = compact_news_articles(
+                load_news_articles(self.news_path))
+        self._news_signature = file_signature(self.news_path)
+        self._derived.clear()
+        self.version += 1
+        return True
+
+    def _refresh(self) -> None:
+        news_changed = self._refresh_news()
+        if file_signature(self.behaviors_path) is None:
+            download_news_articles()
+        signature = file_signature(self.behaviors_path)
+        if self._engagement is None:
+            self._engagement = EngagementTable(self.behaviors_path)
+        elif not news_changed and signature == self._engagement_signature:
+            return
+        # only the engagements appended since the last refresh are read
+        if self._engagement.refresh(self._news):
+            self._derived.clear()
+            self.version += 1
+        self._engagement_signature = signature
+
+    def current_version(self) -> int:
+        """ Reloads whatever changed on disk and returns the dataset version.
+
+        Returns:
+            int: the version, bumped on every reload.
+        """
+
+        with self._lock:
+            self._refresh()
+            return self.version
+
+    @property
+    def news(self) -> pl.DataFrame:
+        """ DataFrame: the compact news articles, see compact_news_articles,
+        reloaded if news.tsv changed.
+        """
+
+        with self._lock:
+            self._refresh_news()
+            return self._news
+
+    @property
+    def engagement(self) -> pl.DataFrame:
+        """ DataFrame: the news_id, category, clicks and impressions of every
+        news article shown, updated if behaviors.tsv grew.
+        """
+
+        with self._lock:
+            self._refresh()
+            return self._engagement.table
+
+    def derived(self, name: str, build: Callable[[], Any]) -> Any:
+        """ Returns a table derived from the dataset, building it on first use
+        and again after every reload.
+
+        Args:
+            name (str): the name the derived table is cached under.
+            build (callable): builds the table from this store's data.
+
+        Returns:
+            Any: the derived table.
+        """
+
+        with self._lock:
+            self._refresh()
+            if name not in self._derived:
+                self._derived[name] = build()
+            return self._derived[name]
+
+    @property
+    def click_counts(self) -> pl.DataFrame:
+        """ DataFrame: the news_id, category and click count of every clicked
+        news article.
+        """
+
+        return self.derived(
+            "click_counts",
+            lambda: self._engagement.table.filter(
+                pl.col("clicks") > 0
+            ).select(
+                pl.col("news_id"),
+                pl.col("category"),
+                pl.col("clicks")
+            ))
+
+    @property
+    def articles(self) -> dict[str, Article]:
+        """ dict[str, Article]: every news article by its news_id, rebuilt
+        after every reload.
+        """
+
+        return self.derived("articles",
+                            lambda: build_article_index(self._news))
+
+    def get_article(self, news_id: str) -> Article | None:
+        """ Looks up a news article by its news_id.
+
+        Args:
+            news_id (str): the article's news_id.
+
+        Returns:
+            Article | None: the news article, or None if there is none.
+        """
+
+        return self.articles.get(news_id)
+
+    def get_articles(self, news_ids: list[str]) -> list[Article | None]:
+        """ Looks up several news articles by their news_id at once.
+
+        Args:
+            news_ids (list[str]): the articles' news_ids.
+
+        Returns:
+            list[Article | None]: the news articles in the same order, with
+                None for every news_id that has no article.
+        """
+
+        articles = self.articles
+        return [articles.get(news_id) for news_id in news_ids]
+
+    @property
+    def titles(self) -> TitleIndex:
+        """ TitleIndex: finds news articles by their exact or approximate
+        title, rebuilt after every reload.
+        """
+
+        return self.derived("titles", lambda: TitleIndex(self._news))
+
+    @property
+    def top_news(self) -> dict:
+        """ dict: the clicked news articles of every category and every
+        (category, subcategory) pair, as (news_id, title, clicks) tuples ranked
+        by clicks, rebuilt after every engagement refresh.
+        """
+
+        return self.derived(
+            "top_news",
+            lambda: build_top_news_index(self._news, self._engagement.table))
+
+    @property
+    def trending(self) -> TrendingIndex:
+        """ TrendingIndex: ranks the news articles by their recent clicks,
+        rebuilt after every engagement refresh.
+        """
+
+        return self.derived(
+            "trending",
+            lambda: TrendingIndex(self._news, self._engagement.hourly_clicks))
+
+    def warm_up(self) -> None:
+        """ Loads the dataset and builds the indexes the news functions use,
+        so the first request doesn't wait for them.
+        """
+
+        # the indexes are built the first time they are accessed
+        for name in ("articles", "titles", "top_news", "trending"):
+            getattr(self, name)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_news_store() -> NewsStore:
+    """ Returns the process-wide news store, creating it on first use.
+
+    Returns:
+        NewsStore: the shared news store.
+    """
+
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = NewsStore()
+        return _store
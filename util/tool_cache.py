@@ -0,0 +1,162 @@
+""" This module memoizes the results of the news functions that only depend
+on their arguments and on the dataset, so popular queries skip the lookups
+and translations entirely.
+"""
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+from dotenv import load_dotenv
+
+from util.store import get_news_store
+
+
+def normalize_argument(value):
+    """ Normalizes an argument so equivalent calls share a cache entry.
+
+    Args:
+        value: the argument's value.
+
+    Returns:
+        the value with surrounding whitespace stripped from strings and whole
+            floats turned into ints, also inside lists.
+    """
+
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, list | tuple):
+        return [normalize_argument(item) for item in value]
+    return value
+
+
+class ToolCache:
+    """ A bounded LRU cache of function results keyed by the function name,
+    its normalized arguments and the dataset version.
+
+    Entries expire after `ttl` seconds, and all of them are dropped as soon
+    as the dataset is reloaded. All methods are thread-safe.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+
+    def get(self, key: tuple, version: int) -> str | None:
+        """ Looks up a cached function result.
+
+        Args:
+            key (tuple): the function name and its normalized arguments.
+            version (int): the current dataset version.
+
+        Returns:
+            str | None: the cached result, or None on a miss.
+        """
+
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, version: int, result: str) -> None:
+        """ Stores a function result.
+
+        Args:
+            key (tuple): the function name and its normalized arguments.
+            version (int): the dataset version the result was computed from.
+            result (str): the function's result.
+        """
+
+        with self._lock:
+            if version != self._version:
+                return
+            self._entries[key] = (result, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """ Returns the hit and miss counters of the cache.
+
+        Returns:
+            dict: the number of hits and misses, and the cached entries.
+        """
+
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "entries": len(self._entries)}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tool_cache() -> ToolCache:
+    """ Returns the process-wide tool cache, creating it on first use from the
+    TOOL_CACHE_* environment variables.
+
+    Returns:
+        ToolCache: the shared tool cache.
+    """
+
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            load_dotenv()
+            _cache = ToolCache(
+                max_size=int(os.getenv("TOOL_CACHE_SIZE", "1024")),
+                ttl=float(os.getenv("TOOL_CACHE_TTL", "3600")))
+        return _cache
+
+
+def cached_tool(function: Callable) -> Callable:
+    """ Decorates a news function whose result only depends on its arguments
+    and the dataset, so its results are served from the tool cache.
+
+    Args:
+        function (callable): the news function.
+
+    Returns:
+        callable: the memoized news function, with the same signature.
+    """
+
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        key = (function.__name__, json.dumps(
+            {name: normalize_argument(value)
+             for name, value in arguments.arguments.items()},
+            sort_keys=True))
+
+        cache = get_tool_cache()
+        version = get_news_store().current_version()
+        result = cache.get(key, version)
+        if result is None:
+            result = function(*args, **kwargs)
+            cache.put(key, version, result)
+        return result
+
+    return wrapper
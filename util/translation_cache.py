@@ -0,0 +1,222 @@
+""" This module caches translations in memory and in a local SQLite database,
+so repeated texts aren't sent to Azure AI Translator again, even after a
+restart.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+# expired and least recently used entries are pruned once every so many
+# writes, so the database may briefly hold that many entries over its size
+PRUNE_INTERVAL = 256
+
+
+class TranslationCache:
+    """ A two-tier cache of translations keyed by the hash of the source text
+    and the target language.
+
+    Lookups go to a bounded in-memory LRU first, then to a SQLite database
+    that survives restarts. Entries of both tiers expire after `ttl` seconds.
+    All methods are thread-safe, and memory hits don't wait for the
+    database.
+    """
+
+    def __init__(self, path: str, memory_size: int = 1024,
+                 disk_size: int = 100_000, ttl: float = 30 * 24 * 3600):
+        self.path = path
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.ttl = ttl
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # guards the database connection, which is slower than the memory
+        self._disk_lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._connection = None
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path,
+                                               check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT PRIMARY KEY, translation TEXT NOT NULL, "
+                "created REAL NOT NULL, used REAL NOT NULL)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS translations_used "
+                "ON translations (used)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS translations_created "
+                "ON translations (created)")
+        return self._connection
+
+    @staticmethod
+    def key(text: str, target_lang: str) -> str:
+        """ Builds the cache key of a translation.
+
+        Args:
+            text (str): the source text.
+            target_lang (str): the target language.
+
+        Returns:
+            str: the cache key.
+        """
+
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return target_lang + ":" + digest
+
+    def get(self, text: str, target_lang: str) -> str | None:
+        """ Looks up the translation of a text.
+
+        Args:
+            text (str): the source text.
+            target_lang (str): the target language.
+
+        Returns:
+            str | None: the cached translation, or None on a miss.
+        """
+
+        key = self.key(text, target_lang)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[0]
+
+        row = None
+        with self._disk_lock:
+            try:
+                connection = self._connect()
+                row = connection.execute(
+                    "SELECT translation, created FROM translations "
+                    "WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] + self.ttl > now:
+                    connection.execute(
+                        "UPDATE translations SET used = ? WHERE key = ?",
+                        (now, key))
+                    connection.commit()
+                else:
+                    row = None
+            except sqlite3.Error as error:
+                print("Could not read the translation cache:", error)
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self._remember(key, row[0], row[1] + self.ttl)
+            self.disk_hits += 1
+            return row[0]
+
+    def put(self, text: str, target_lang: str, translation: str) -> None:
+        """ Stores the translation of a text in both tiers.
+
+        Args:
+            text (str): the source text.
+            target_lang (str): the target language.
+            translation (str): the translated text.
+        """
+
+        self.put_many([(text, translation)], target_lang)
+
+    def put_many(self, translations: list[tuple[str, str]],
+                 target_lang: str) -> None:
+        """ Stores the translations of several texts in both tiers, writing
+        them to the database in a single transaction.
+
+        Args:
+            translations (list[tuple[str, str]]): the source text and the
+                translated text of each translation.
+            target_lang (str): the target language.
+        """
+
+        if not translations:
+            return
+        now = time.time()
+        rows = [(self.key(text, target_lang), translation, now, now)
+                for text, translation in translations]
+        with self._lock:
+            for key, translation, _, _ in rows:
+                self._remember(key, translation, now + self.ttl)
+
+        with self._disk_lock:
+            try:
+                connection = self._connect()
+                connection.executemany(
+                    "INSERT OR REPLACE INTO translations "
+                    "VALUES (?, ?, ?, ?)", rows)
+                self._writes += len(rows)
+                if self._writes >= PRUNE_INTERVAL:
+                    self._writes = 0
+                    # drop expired entries, then the least recently used
+                    # ones over the size limit
+                    connection.execute(
+                        "DELETE FROM translations WHERE created < ?",
+                        (now - self.ttl,))
+                    connection.execute(
+                        "DELETE FROM translations WHERE key IN ("
+                        "SELECT key FROM translations ORDER BY used DESC "
+                        "LIMIT -1 OFFSET ?)", (self.disk_size,))
+                connection.commit()
+            except sqlite3.Error as error:
+                print("Could not write the translation cache:", error)
+
+    def _remember(self, key: str, translation: str, expires: float) -> None:
+        self._memory[key] = (translation, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        """ Returns the hit and miss counters of the cache.
+
+        Returns:
+            dict: the number of memory hits, disk hits and misses.
+        """
+
+        with self._lock:
+            return {"memory_hits": self.memory_hits,
+                    "disk_hits": self.disk_hits,
+                    "misses": self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_translation_cache() -> TranslationCache:
+    """ Returns the process-wide translation cache, creating it on first use
+    from the TRANSLATION_CACHE_* environment variables.
+
+    Returns:
+        TranslationCache: the shared translation cache.
+    """
+
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            load_dotenv()
+            _cache = TranslationCache(
+                os.getenv("TRANSLATION_CACHE_PATH",
+                          "data/translations.sqlite3"),
+                memory_size=int(os.getenv("TRANSLATION_CACHE_MEMORY_SIZE",
+                                          "1024")),
+                disk_size=int(os.getenv("TRANSLATION_CACHE_DISK_SIZE",
+                                        "100000")),
+                ttl=float(os.getenv("TRANSLATION_CACHE_TTL",
+                                    str(30 * 24 * 3600))))
+        return _cache